@@ -33,28 +33,16 @@ DEMO_DIR.mkdir(parents=True, exist_ok=True)
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
 # -----------------------------
-# TTS: gTTS + pydub (simple, free)
+# TTS: pluggable backend (tts.py), PCM in memory
 # -----------------------------
-def text_to_wav_gtts(text: str, wav_out: Path, sr: int = 16000, channels: int = 1):
+def text_to_wav(text: str, wav_out: Path, sr: int = 16000, channels: int = 1, backend: str = None):
     """
-    Generate WAV via gTTS (MP3) -> pydub convert to PCM s16 WAV.
+    Synthesize with a tts.py backend (gtts, local) through the phrase audio cache and write a PCM s16 WAV.
     """
-    try:
-        from gtts import gTTS
-        from pydub import AudioSegment
-    except ImportError:
-        print("Installing gTTS + pydub ...", flush=True)
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "gtts", "pydub"])
-        from gtts import gTTS
-        from pydub import AudioSegment
+    from tts import get_backend, write_wav
 
-    tmp_mp3 = DEMO_DIR / f"_tmp_{uuid.uuid4().hex}.mp3"
-    gTTS(text=text, lang="en").save(str(tmp_mp3))
-
-    audio = AudioSegment.from_mp3(str(tmp_mp3))
-    audio = audio.set_frame_rate(sr).set_channels(channels).set_sample_width(2)  # 16-bit PCM
-    audio.export(str(wav_out), format="wav")
-    tmp_mp3.unlink(missing_ok=True)
+    pcm = get_backend(backend, cached=True).synthesize(text, sr)
+    write_wav(wav_out, pcm, sr, channels)
     return wav_out
 
 # -----------------------------
@@ -124,6 +112,7 @@ def main():
     p.add_argument("--no-portrait", action="store_true")
     p.add_argument("--sr", type=int, default=16000, help="WAV sample rate for TTS.")
     p.add_argument("--channels", type=int, default=1, help="WAV channels for TTS.")
+    p.add_argument("--tts", default=None, help="TTS backend: gtts or local (default: $TTS_BACKEND or gtts).")
     p.add_argument("--extra", nargs=argparse.REMAINDER, help="Any extra flags passed to your main.py")
     args = p.parse_args()
 
@@ -133,7 +122,7 @@ def main():
     # Make wav if needed
     if args.text:
         wav_out = DEMO_DIR / "JNoutput.wav"  # fixed output name your pipeline expects
-        text_to_wav_gtts(args.text, wav_out, sr=args.sr, channels=args.channels)
+        text_to_wav(args.text, wav_out, sr=args.sr, channels=args.channels, backend=args.tts)
         print(f"✅ Wrote WAV: {wav_out}")
     else:
         wav_out = Path(args.wav).resolve()
@@ -1,20 +1,17 @@
 # Import libraries
-from gtts import gTTS
-from pydub import AudioSegment
+import sys
+from tts import get_backend, write_wav
 
 # Input text
-text = "Hello! This is a test of converting text to a WAV audio file."
+text = sys.argv[1] if len(sys.argv) > 1 else "Hello! This is a test of converting text to a WAV audio file."
+wav_out = sys.argv[2] if len(sys.argv) > 2 else "JNoutput.wav"
 
-# Convert text → temporary MP3
-tts = gTTS(text)
-tts.save("/Users/lukegeel/Desktop/temp.mp3")
+# Convert text → 16 kHz PCM in memory (backend from $TTS_BACKEND: gtts or local) → WAV
+pcm = get_backend().synthesize(text, 16000)
+write_wav(wav_out, pcm, 16000)
 
-# Convert MP3 → WAV using pydub
-audio = AudioSegment.from_mp3("/Users/lukegeel/Desktop/temp.mp3")
-audio.export("/Users/lukegeel/Desktop/JNoutput.wav", format="wav")
-
-print("✅ Saved output.wav successfully!")
+print(f"✅ Saved {wav_out} successfully!")
 
 # (Optional) Play the result
 #from IPython.display import Audio
-#Audio("/Users/lukegeel/Desktop/JNoutput.wav")
+#Audio(wav_out)
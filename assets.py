@@ -0,0 +1,179 @@
+# assets.py
+"""
+Boot-time asset verification / download for the render services.
+
+Each asset is a directory (e.g. data/May, model/trial_may) that is fetched as a
+zip from Google Drive when missing. After the first successful check a manifest
+records the expected files with their size and sha256, later boots verify
+against it. A file lock serializes the download / unzip / rename steps when
+several workers start at once.
+
+    ASSETS = AssetManager(PROJECT_ROOT, may_assets(DATA_ROOT, WORKSPACE))
+    ASSETS.ensure()      # once, at startup
+    ASSETS.status()      # for /health
+"""
+import fcntl, glob, hashlib, json, os, shutil, subprocess, sys, time
+from pathlib import Path
+
+GDRIVE_DATA_ID  = "18Q2H612CAReFxBd9kxr-i1dD8U1AUfsV"  # May.zip
+GDRIVE_MODEL_ID = "1C2639qi9jvhRygYHwPZDGs8pun3po3W7"  # trial_may.zip
+
+
+def may_assets(data_root, workspace):
+    # the pre-trained May avatar from the README
+    return [
+        {
+            "name": "data",
+            "path": Path(data_root),
+            "gdrive_id": GDRIVE_DATA_ID,
+            "files": ["transforms_train.json", "transforms_val.json", "bc.jpg", "aud.wav", "bs.npy"],
+        },
+        {
+            "name": "model",
+            "path": Path(workspace),
+            "gdrive_id": GDRIVE_MODEL_ID,
+            "files": ["checkpoints/*.pth"],
+        },
+    ]
+
+
+def sha256sum(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _run(cmd: list):
+    proc = subprocess.run(cmd, text=True, capture_output=True)
+    if proc.returncode != 0:
+        print("CMD FAILED:", " ".join(cmd))
+        print("STDOUT:", proc.stdout)
+        print("STDERR:", proc.stderr)
+        raise RuntimeError(f"Command failed: {' '.join(cmd)}")
+    return proc.stdout
+
+
+class AssetManager:
+    def __init__(self, project_root, assets, manifest_path=None):
+        self.project_root = Path(project_root)
+        self.assets = assets
+        self.manifest_path = Path(manifest_path or self.project_root / "model" / "assets_manifest.json")
+        self.lock_path = self.manifest_path.with_suffix(".lock")
+        self.state = {a["name"]: {"path": str(a["path"]), "state": "unchecked"} for a in assets}
+        self.checked_at = None
+
+    def ensure(self):
+        # verify every asset, download what is missing. Call once at boot, not per request.
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX) # other workers wait here until we are done
+            try:
+                manifest = self._load_manifest()
+                for asset in self.assets:
+                    try:
+                        manifest[asset["name"]] = self._ensure_asset(asset, manifest.get(asset["name"]))
+                    except Exception as e:
+                        print(f"[BOOT] asset {asset['name']} failed: {e}")
+                        self.state[asset["name"]].update(state="error", error=str(e))
+                self._save_manifest(manifest)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.checked_at = time.time()
+        return self.ready()
+
+    def ready(self):
+        return all(s["state"] in ("ok", "downloaded", "changed") for s in self.state.values())
+
+    def status(self):
+        return {"ready": self.ready(), "checked_at": self.checked_at, "assets": self.state}
+
+    # --- internals ---
+
+    def _ensure_asset(self, asset, recorded):
+        name, path = asset["name"], asset["path"]
+        state = "ok"
+
+        if not self._expected_files(asset):
+            self._download(asset)
+            recorded = None
+            state = "downloaded"
+
+        files = self._expected_files(asset)
+        if not files:
+            raise FileNotFoundError(f"{path} is missing {asset['files']}")
+
+        entry = {}
+        for rel in files:
+            full = path / rel
+            size = full.stat().st_size
+            old = (recorded or {}).get(rel)
+            # only re-hash when size/mtime moved, so a normal boot is cheap
+            if old and old["size"] == size and old["mtime"] == full.stat().st_mtime:
+                entry[rel] = old
+                continue
+            digest = sha256sum(full)
+            if old and old["sha256"] != digest:
+                print(f"[BOOT] {name}: {rel} changed since last boot (checksum mismatch)")
+                state = "changed"
+            entry[rel] = {"size": size, "mtime": full.stat().st_mtime, "sha256": digest}
+
+        self.state[name].update(state=state, files=len(entry))
+        print(f"[BOOT] asset {name}: {state} ({len(entry)} files) {path}")
+        return entry
+
+    def _expected_files(self, asset):
+        path = asset["path"]
+        if not path.is_dir():
+            return []
+        files = []
+        for pattern in asset["files"]:
+            matches = sorted(glob.glob(str(path / pattern)))
+            if not matches:
+                return []
+            files.extend(os.path.relpath(m, path) for m in matches)
+        return files
+
+    def _gdown(self):
+        gdown = shutil.which("gdown")
+        if gdown is None:
+            _run([sys.executable, "-m", "pip", "install", "gdown"])
+            gdown = shutil.which("gdown") or "gdown"
+        return gdown
+
+    def _download(self, asset):
+        path = asset["path"]
+        parent = path.parent
+        parent.mkdir(parents=True, exist_ok=True)
+        zip_path = parent / f"{path.name}.zip"
+
+        print(f"[BOOT] Downloading {zip_path.name}…")
+        _run([self._gdown(), "--fuzzy", f"https://drive.google.com/uc?id={asset['gdrive_id']}", "-O", str(zip_path)])
+        print(f"[BOOT] Unzipping {zip_path.name}…")
+        _run(["unzip", "-o", str(zip_path), "-d", str(parent)])
+        try: zip_path.unlink()
+        except: pass
+
+        if not path.is_dir():
+            # Try to normalize folder name (e.g. "may" -> "May")
+            candidates = [p for p in parent.glob("*") if p.is_dir()]
+            pick = next((p for p in candidates if p.name.lower() == path.name.lower()), candidates[0] if candidates else None)
+            if pick and pick != path:
+                print(f"[BOOT] Renaming '{pick}' -> '{path}'")
+                shutil.move(str(pick), str(path))
+
+    def _load_manifest(self):
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                print(f"[WARN] corrupt asset manifest {self.manifest_path}, rebuilding")
+        return {}
+
+    def _save_manifest(self, manifest):
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
@@ -0,0 +1,146 @@
+# avatars.py
+"""
+Registry of trained avatars, with a bounded number of them resident.
+
+An avatar is an id mapped to its data dir (transforms, bc.jpg, aud.wav, ...),
+its workspace and optionally a checkpoint (default: latest in the workspace).
+Engines are loaded on first use and kept in LRU order, at most `max_resident`
+at a time. All of them share the resident AVE AudioEncoder of
+nerf_triplane.audio_features, it does not depend on the avatar.
+
+    AVATARS = AvatarRegistry(load_avatars("avatars.json", default), max_resident=2)
+    engine = AVATARS.get("may")          # RenderEngine, loaded or reused
+
+avatars.json:
+    {"may": {"data": "data/May", "workspace": "model/trial_may"},
+     "obama": {"data": "data/Obama", "workspace": "model/trial_obama", "checkpoint": "model/trial_obama/checkpoints/ngp_ep0050.pth"}}
+"""
+import glob, json, os, threading, time
+from collections import OrderedDict
+from pathlib import Path
+
+from render_engine import RenderEngine, MockRenderEngine
+
+
+class UnknownAvatar(KeyError):
+    pass
+
+
+def latest_checkpoint(workspace):
+    # the checkpoint Trainer loads without --ckpt (latest ngp_ep*.pth of the workspace)
+    ckpts = sorted(glob.glob(os.path.join(workspace, "checkpoints", "ngp_ep*.pth")))
+    return ckpts[-1] if ckpts else None
+
+
+def load_avatars(path=None, defaults=None):
+    # avatar id -> {"data", "workspace", "checkpoint"?, "portrait"?}; relative paths are relative to the file
+    avatars = dict(defaults or {})
+    if path is not None and os.path.exists(path):
+        base = Path(path).resolve().parent
+        with open(path, "r") as f:
+            for avatar_id, spec in json.load(f).items():
+                spec = dict(spec)
+                for k in ("data", "workspace", "checkpoint"):
+                    if spec.get(k):
+                        spec[k] = str(base / spec[k])
+                avatars[avatar_id] = spec
+    return avatars
+
+
+class AvatarRegistry:
+    def __init__(self, avatars, max_resident=2, portrait=True, backend="nerf", **engine_kwargs):
+        # backend: "nerf" (RenderEngine) or "mock" (MockRenderEngine, no torch / GPU, for load tests)
+        if backend not in ("nerf", "mock"):
+            raise ValueError(f"unknown render backend {backend!r}, expected nerf or mock")
+        self.avatars = avatars
+        self.max_resident = max_resident
+        self.portrait = portrait
+        self.backend = backend
+        self.engine_kwargs = engine_kwargs # max_concurrent, batch_frames, ...
+
+        self.engines = OrderedDict() # avatar id -> RenderEngine, least recently used first
+        self.lock = threading.Lock()
+        self.loading = {} # avatar id -> Lock, one load per avatar at a time
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, avatar_id):
+        if avatar_id not in self.avatars:
+            raise UnknownAvatar(avatar_id)
+
+        with self.lock:
+            engine = self.engines.get(avatar_id)
+            if engine is not None:
+                self.engines.move_to_end(avatar_id)
+                return engine
+            load_lock = self.loading.setdefault(avatar_id, threading.Lock())
+
+        with load_lock:
+            # someone else may have loaded it while we waited
+            with self.lock:
+                engine = self.engines.get(avatar_id)
+                if engine is not None:
+                    self.engines.move_to_end(avatar_id)
+                    return engine
+
+            engine = self._load(avatar_id)
+
+            with self.lock:
+                self.engines[avatar_id] = engine
+                evicted = []
+                while len(self.engines) > self.max_resident:
+                    evicted.append(self.engines.popitem(last=False))
+
+        for old_id, old in evicted:
+            # renders still holding the engine finish normally, memory is freed after them
+            print(f"[INFO] evicting avatar {old_id}")
+            old.close()
+            self.evictions += 1
+        if evicted and self.backend != "mock":
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        return engine
+
+    def cache_id(self, avatar_id):
+        # everything about an avatar that changes the rendered video, for result cache keys.
+        # from its spec alone: never loads the engine (nor evicts another one) on the request path.
+        if avatar_id not in self.avatars:
+            raise UnknownAvatar(avatar_id)
+        spec = self.avatars[avatar_id]
+        ckpt = spec.get("checkpoint") or latest_checkpoint(spec["workspace"])
+        return {
+            "backend": self.backend,
+            "data": os.path.abspath(spec["data"]),
+            "workspace": os.path.abspath(spec["workspace"]),
+            "checkpoint": [os.path.abspath(ckpt), os.path.getsize(ckpt), os.path.getmtime(ckpt)] if ckpt and os.path.exists(ckpt) else None,
+            "portrait": spec.get("portrait", self.portrait),
+            "extra_args": ["--ckpt", spec["checkpoint"]] if spec.get("checkpoint") else None,
+        }
+
+    def resident(self):
+        with self.lock:
+            return list(self.engines)
+
+    def stats(self):
+        return {
+            "avatars": sorted(self.avatars),
+            "resident": self.resident(),
+            "max_resident": self.max_resident,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def _load(self, avatar_id):
+        spec = self.avatars[avatar_id]
+        if self.backend == "mock":
+            return MockRenderEngine(spec["data"], spec["workspace"], **self.engine_kwargs)
+        extra_args = ["--ckpt", spec["checkpoint"]] if spec.get("checkpoint") else None
+
+        t = time.time()
+        engine = RenderEngine(spec["data"], spec["workspace"], portrait=spec.get("portrait", self.portrait),
+                              extra_args=extra_args, **self.engine_kwargs)
+        self.loads += 1
+        print(f"[INFO] avatar {avatar_id} loaded in {time.time() - t:.2f}s")
+        return engine
@@ -1,4 +1,5 @@
 import os
+import sys
 import glob
 import tqdm
 import json
@@ -10,6 +11,8 @@ import torch.nn.functional as F
 import face_alignment
 from face_tracking.util import euler2rot
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 def extract_audio(path, out_path, sample_rate=16000):
     
@@ -23,12 +26,10 @@ def extract_audio_features(path, mode='ave'):
     print(f'[INFO] ===== extract audio labels for {path} =====')
     if mode == 'ave':
         print(f'AVE has been integrated into the training code, no need to extract audio features')
-    elif mode == "deepspeech": # deepspeech
-        cmd = f'python data_utils/deepspeech_features/extract_ds_features.py --input {path}'
-        os.system(cmd)
-    elif mode == 'hubert':
-        cmd = f'python data_utils/hubert.py --wav {path}' # save to data/<name>_hu.npy
-        os.system(cmd)
+    else:
+        # deepspeech -> <name>_ds.npy, hubert -> <name>_hu.npy, wav2vec -> <name>_eo.npy / <name>.npy
+        from nerf_triplane.audio_features import get_extractor
+        get_extractor(mode).save(path)
     print(f'[INFO] ===== extracted audio labels =====')
 
 
@@ -419,7 +420,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('path', type=str, help="path to video file")
     parser.add_argument('--task', type=int, default=-1, help="-1 means all")
-    parser.add_argument('--asr', type=str, default='ave', help="ave, hubert or deepspeech")
+    parser.add_argument('--asr', type=str, default='ave', help="ave, hubert, deepspeech or wav2vec")
 
 
     opt = parser.parse_args()
@@ -0,0 +1,126 @@
+# disk_cache.py
+"""
+Content-addressed file cache on disk with LRU eviction under a byte budget.
+
+Files live in `root/<key><suffix>`, an `index.json` next to them records size
+and last access time so the LRU order survives restarts. Hits only update the
+access time in memory, the index is written on put (with its eviction): a hit
+costs no disk write, recency of hits after the last put is lost on a crash.
+
+    cache = DiskCache("model/trial_may/results/cache", max_bytes=2 << 30, suffix=".mp4")
+    key = cache_key({"text": normalize_text(text), "checkpoint": ckpt})
+    path = cache.get(key) or cache.put(key, render(text))
+"""
+import hashlib, json, os, re, shutil, threading, time, uuid
+from pathlib import Path
+
+
+def normalize_text(text):
+    # case and whitespace do not change the synthesized speech
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def cache_key(parts):
+    # parts: any json-serializable description of everything that affects the output
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, root, max_bytes, suffix=""):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.index_path = self.root / "index.json"
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index = {}
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, "r") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                print(f"[WARN] corrupt cache index {self.index_path}, starting empty")
+        # drop entries whose file went missing
+        self.index = {k: v for k, v in self.index.items() if self.path(k).exists()}
+
+    def path(self, key):
+        return self.root / f"{key}{self.suffix}"
+
+    def get(self, key):
+        # returns the cached file path, or None on miss
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not self.path(key).exists():
+                self.index.pop(key, None)
+                self.misses += 1
+                return None
+            entry["atime"] = time.time()  # written with the next put
+            self.hits += 1
+            return self.path(key)
+
+    def put(self, key, src, move=False):
+        # copy (or move) `src` into the cache under `key`, returns the cached path.
+        # a file larger than the whole budget is not cached, `src` stays where it is and is returned.
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            print(f"[WARN] {src} ({size} bytes) is larger than the cache ({self.max_bytes} bytes), not cached")
+            return Path(src)
+        dst = self.path(key)
+        tmp = self.root / f".{uuid.uuid4().hex}.tmp"
+        if move:
+            shutil.move(str(src), str(tmp))
+        else:
+            shutil.copyfile(str(src), str(tmp))
+        os.replace(tmp, dst)
+
+        with self.lock:
+            self.index[key] = {"size": dst.stat().st_size, "atime": time.time()}
+            self._evict(keep=key)
+            self._save_index()
+        return dst
+
+    def put_bytes(self, key, data):
+        # same as put, for content that only exists in memory. returns None when it is too large to cache.
+        if len(data) > self.max_bytes:
+            return None
+        tmp = self.root / f".{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self.put(key, tmp, move=True)
+
+    def total_bytes(self):
+        return sum(e["size"] for e in self.index.values())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.index),
+                "bytes": self.total_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self, keep=None):
+        # least recently used first, until we are under budget. `keep` (the entry just added) stays.
+        total = self.total_bytes()
+        for key in sorted(self.index, key=lambda k: self.index[k]["atime"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.index.pop(key)["size"]
+            try:
+                self.path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _save_index(self):
+        tmp = self.index_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
@@ -1,9 +1,16 @@
 # gpu_worker.py
 from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
-import os, uuid, subprocess, shlex, glob
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+import hashlib, os, uuid, shutil, wave
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
+from starlette.concurrency import run_in_threadpool
+
+from avatars import AvatarRegistry, UnknownAvatar, load_avatars
+from nerf_triplane.telemetry import REGISTRY
+from jobs import Job, JobManager, Overloaded
+from assets import AssetManager, may_assets
+from retention import Retention
 
 
 
@@ -12,10 +19,124 @@ PROJECT_ROOT="/app"
 DATA_ROOT=f"{PROJECT_ROOT}/data/May"
 WORKSPACE=f"{PROJECT_ROOT}/model/trial_may"
 OUT_DIR=f"{WORKSPACE}/results"
-os.makedirs(OUT_DIR, exist_ok=True)
+JOBS_DIR=f"{OUT_DIR}/jobs"  # one working directory per request
+os.makedirs(JOBS_DIR, exist_ok=True)
+RENDER_SLOTS=int(os.environ.get("RENDER_SLOTS", "1"))
+# admission control: queued jobs at most, and the longest estimated wait we accept (seconds)
+MAX_QUEUE=int(os.environ.get("MAX_QUEUE", "16"))
+MAX_WAIT_S=float(os.environ.get("MAX_WAIT_S", "120"))
+# finished jobs answer /jobs/{id} this long / this many of them, then 410
+JOBS_KEEP=int(os.environ.get("JOBS_KEEP", "1000"))
+JOBS_TTL_S=float(os.environ.get("JOBS_TTL_S", "3600"))
+# frames of concurrent renders batched into one network pass, and the latency a frame may wait for a batch
+RENDER_BATCH_FRAMES=int(os.environ.get("RENDER_BATCH_FRAMES", str(RENDER_SLOTS)))
+RENDER_BATCH_WAIT_MS=float(os.environ.get("RENDER_BATCH_WAIT_MS", "10"))
+# work dirs: input.wav and the silent / depth mp4 go when the job ends, finished dirs by age / total size
+JOBS_MAX_BYTES=int(os.environ.get("JOBS_MAX_BYTES", str(5 << 30)))
+JOBS_MAX_AGE_S=float(os.environ.get("JOBS_MAX_AGE_S", str(24 * 3600)))
+RETENTION = Retention(JOBS_DIR, max_bytes=JOBS_MAX_BYTES, max_age=JOBS_MAX_AGE_S)
+RETENTION.start()
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
+# the image normally ships data/ and model/, this verifies them once at boot (and fetches what is missing)
+ASSETS = AssetManager(PROJECT_ROOT, may_assets(DATA_ROOT, WORKSPACE))
+
+# RENDER_BACKEND=mock renders placeholder frames without torch / GPU / assets (load tests, capacity planning)
+RENDER_BACKEND=os.environ.get("RENDER_BACKEND", "nerf")
+# avatar id -> (data dir, workspace, checkpoint), engines stay resident (LRU-bounded), every /render reuses them
+DEFAULT_AVATAR=os.environ.get("DEFAULT_AVATAR", "may")
+MAX_RESIDENT_AVATARS=int(os.environ.get("MAX_RESIDENT_AVATARS", "2"))
+AVATARS = AvatarRegistry(
+    load_avatars(os.environ.get("AVATARS_CONFIG", f"{PROJECT_ROOT}/avatars.json"),
+                 defaults={"may": {"data": DATA_ROOT, "workspace": WORKSPACE}}),
+    max_resident=MAX_RESIDENT_AVATARS, portrait=True, backend=RENDER_BACKEND, max_concurrent=RENDER_SLOTS,
+    batch_frames=RENDER_BATCH_FRAMES, batch_wait_ms=RENDER_BATCH_WAIT_MS,
+)
+
+@app.on_event("startup")
+def load_engine():
+    if RENDER_BACKEND != "mock" and not ASSETS.ensure():
+        raise RuntimeError(f"assets not ready: {ASSETS.status()}")
+    AVATARS.get(DEFAULT_AVATAR)  # warm: the default avatar is resident before the first request
+
+JOBS = JobManager(num_slots=RENDER_SLOTS, max_queue=MAX_QUEUE, max_wait=MAX_WAIT_S, max_finished=JOBS_KEEP, finished_ttl=JOBS_TTL_S)
+
+def job_not_found(job_id: str):
+    # 410 for finished jobs the manager already forgot, 404 for ids it never had
+    if JOBS.expired(job_id):
+        return JSONResponse({"error": "job expired", "id": job_id}, status_code=410)
+    return JSONResponse({"error": "unknown job"}, status_code=404)
+
+@app.exception_handler(Overloaded)
+def overloaded(request, exc: Overloaded):
+    # graceful degradation: tell the client when to come back instead of queueing without bound
+    return JSONResponse({"error": "overloaded", "reason": exc.reason, "retry_after": exc.retry_after},
+                        status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)})
+
+async def save_upload(wav: UploadFile):
+    # every request gets its own directory, so concurrent renders never share a file
+    work_dir = f"{JOBS_DIR}/{uuid.uuid4().hex}"
+    os.makedirs(work_dir, exist_ok=True)
+    RETENTION.track(work_dir)
+    wav_path = f"{work_dir}/input.wav"
+    with open(wav_path, "wb") as f:
+        f.write(await wav.read())
+    return work_dir, wav_path
+
+# --- Prometheus metrics: stage histograms live in nerf_triplane.telemetry, gauges are read at scrape time ---
+REGISTRY.gauge("synctalk_queue_depth", "jobs waiting for a render slot", fn=lambda: JOBS.queued)
+REGISTRY.gauge("synctalk_jobs_running", "jobs on a render slot", fn=lambda: JOBS.running)
+REGISTRY.gauge("synctalk_estimated_wait_seconds", "estimated queue wait of a new job", fn=JOBS.estimated_wait)
+REGISTRY.counter("synctalk_jobs_rejected_total", "jobs refused by admission control since start", fn=lambda: JOBS.rejected)
+REGISTRY.counter("synctalk_jobs_coalesced_total", "requests attached to an identical in-flight job since start", fn=lambda: JOBS.coalesced)
+REGISTRY.gauge("synctalk_render_fps", "measured frames/s per render slot", fn=lambda: JOBS.fps)
+REGISTRY.gauge("synctalk_jobs_dir_bytes", "bytes in per-request work dirs", fn=lambda: RETENTION.usage()["jobs_bytes"])
+REGISTRY.gauge("synctalk_disk_free_bytes", "free space on the results volume", fn=lambda: RETENTION.usage()["disk"]["free"])
+REGISTRY.gauge("synctalk_resident_models", "avatar engines (NeRFNetwork + dataset) loaded", fn=lambda: len(AVATARS.resident()))
+
+@app.exception_handler(UnknownAvatar)
+def unknown_avatar(request, exc: UnknownAvatar):
+    return JSONResponse({"error": "unknown avatar", "avatar": exc.args[0], "avatars": sorted(AVATARS.avatars)}, status_code=404)
+
+def wav_frames(wav_path: str) -> int:
+    # expected video length (25 fps) from the audio duration
+    try:
+        with wave.open(wav_path, "rb") as f:
+            return int(f.getnframes() / f.getframerate() * 25) + 1
+    except (wave.Error, EOFError):
+        return 0  # not plain PCM, counted as free until it renders
+
+def wav_key(wav_path: str, avatar: str) -> str:
+    # identical upload for the same avatar -> same render
+    h = hashlib.sha256(avatar.encode())
+    with open(wav_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def submit_wav_job(work_dir: str, wav_path: str, avatar: str) -> Job:
+    try:
+        if avatar not in AVATARS.avatars:
+            raise UnknownAvatar(avatar)
+        job = JOBS.submit(run_wav_job, work_dir, wav_path, avatar, frames=wav_frames(wav_path), key=wav_key(wav_path, avatar))
+    except (Overloaded, UnknownAvatar):
+        RETENTION.finish(work_dir)
+        raise
+    if job.args[0] != work_dir:
+        # coalesced onto the same wav already in flight, this upload is not needed
+        RETENTION.finish(work_dir)
+    return job
+
+def run_wav_job(job: Job, work_dir: str, wav_path: str, avatar: str = DEFAULT_AVATAR):
+    result = None
+    try:
+        result = AVATARS.get(avatar).render(wav_path, save_path=work_dir, name="render", progress=job.progress)
+        return result
+    finally:
+        # only render_audio.mp4 stays (nothing on failure)
+        RETENTION.finish(work_dir, keep=result)
+
 
 @app.get("/", response_class=HTMLResponse)
 def home():
@@ -31,26 +152,72 @@ def home():
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    engine_loaded = DEFAULT_AVATAR in AVATARS.resident()
+    batchers = {a: e.batcher.stats() for a, e in list(AVATARS.engines.items()) if e.batcher is not None}
+    assets_ok = RENDER_BACKEND == "mock" or ASSETS.ready()
+    return {"ok": engine_loaded and assets_ok, "engine_loaded": engine_loaded, "batcher": batchers or None, **ASSETS.status()}
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.expose(), media_type="text/plain; version=0.0.4")
+
+@app.get("/avatars")
+def avatar_stats():
+    return AVATARS.stats()
+
+@app.get("/queue")
+def queue_stats():
+    # queue depth, estimated wait and measured render speed
+    return JOBS.stats()
+
+@app.get("/disk")
+def disk_usage():
+    # work dirs and free space on the volume
+    return RETENTION.usage()
 
 @app.post("/render")
-async def render(text: str = Form(None), wav: UploadFile = File(None)):
+async def render(text: str = Form(None), wav: UploadFile = File(None), avatar: str = Form(DEFAULT_AVATAR)):
     # write wav
-    wav_path = f"{PROJECT_ROOT}/demo/{uuid.uuid4().hex}.wav"
-    os.makedirs(f"{PROJECT_ROOT}/demo", exist_ok=True)
     if wav:
-        with open(wav_path, "wb") as f:
-            f.write(await wav.read())
+        work_dir, wav_path = await save_upload(wav)
     else:
         return JSONResponse({"error":"no wav"}, status_code=400)
 
-    cmd = f"python {PROJECT_ROOT}/main.py {DATA_ROOT} --workspace {WORKSPACE} -O --test --test_train --asr_model ave --portrait --aud {wav_path}"
-    proc = subprocess.run(shlex.split(cmd), capture_output=True, text=True)
-    if proc.returncode != 0:
-        return JSONResponse({"error":"render failed", "stderr": proc.stderr[-4000:]}, status_code=500)
+    # render on a slot of the bounded job queue (may raise Overloaded), wait off the event loop
+    job = submit_wav_job(work_dir, wav_path, avatar)
+    await run_in_threadpool(job.finished.wait)
+    if job.status == Job.FAILED:
+        return JSONResponse({"error":"render failed", "detail": job.error}, status_code=500)
+
+    out_path = job.result
+    return FileResponse(out_path, media_type="video/mp4", filename=os.path.basename(out_path))
+
+
+# --- Async jobs: POST returns an id immediately, poll status, fetch result ---
+@app.post("/jobs", status_code=202)
+async def submit_job(wav: UploadFile = File(None), avatar: str = Form(DEFAULT_AVATAR)):
+    if not wav:
+        return JSONResponse({"error":"no wav"}, status_code=400)
+    work_dir, wav_path = await save_upload(wav)
+    job = submit_wav_job(work_dir, wav_path, avatar)
+    return {"id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result"}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    return job.to_dict()
 
-    mp4s = glob.glob(f"{OUT_DIR}/*.mp4")
-    if not mp4s:
-        return JSONResponse({"error":"no mp4"}, status_code=500)
-    newest = max(mp4s, key=os.path.getmtime)
-    return FileResponse(newest, media_type="video/mp4", filename=os.path.basename(newest))
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    if job.status == Job.FAILED:
+        return JSONResponse(job.to_dict(), status_code=500)
+    if job.status != Job.DONE:
+        return JSONResponse(job.to_dict(), status_code=409)
+    if not os.path.exists(job.result):
+        return JSONResponse({"error":"result evicted", **job.to_dict()}, status_code=410)
+    return FileResponse(job.result, media_type="video/mp4", filename=os.path.basename(job.result))
@@ -0,0 +1,265 @@
+# jobs.py
+"""
+In-process job queue for the render services.
+
+POST handlers submit a job and return its id immediately, a fixed number of
+render slots (worker threads) drain the queue, clients poll the job status and
+fetch the result once it is done.
+
+    JOBS = JobManager(num_slots=2, max_queue=16, max_wait=120)
+    job = JOBS.submit(run_pipeline, text, frames=250)   # run_pipeline(job, text) -> mp4 path
+    JOBS.get(job.id).to_dict()
+
+Admission control: `frames` is the expected video length of the job (audio
+duration * 25 fps). Together with the measured render speed it gives the
+expected wait of a new job; when the queue is full or that wait is over
+`max_wait` seconds, submit raises Overloaded (with a Retry-After hint) instead
+of piling up work.
+
+Single flight: jobs submitted with a `key` (e.g. the result cache key of the
+normalized request) attach to a queued / running job with the same key instead
+of rendering again, every caller gets the same job and the same artifact.
+
+    job = JOBS.submit(run_pipeline, text, frames=250, key=result_key(text))
+
+Finished jobs are forgotten `finished_ttl` seconds after they ended, and
+beyond the `max_finished` most recent ones. get() returns None for them,
+expired() tells them apart from ids that never existed (410 vs 404).
+"""
+import math, threading, time, traceback, uuid
+from collections import OrderedDict
+from queue import Queue
+
+from nerf_triplane.telemetry import QUEUE_WAIT_SECONDS
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after, status_code=503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class Job:
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+    def __init__(self, fn, args, kwargs, frames=0, key=None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.frames_estimate = frames
+        self.key = key
+        self.followers = 0  # requests coalesced onto this job
+
+        self.status = Job.QUEUED
+        self.frames_done = 0
+        self.frames_total = 0
+        self.result = None  # path of the final mp4
+        self.output = None  # file being written while running, if the job streams its output
+        self.error = None
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+        self.first_frame = threading.Event()  # set on the first rendered frame, or when the job ends
+        self.on_frames_left = None  # callable(delta), keeps the manager's running total of frames to render
+
+    def progress(self, frames_done, frames_total):
+        # matches the progress callback of Trainer.test / RenderEngine.render
+        left = self.frames_left()
+        self.frames_done = frames_done
+        self.frames_total = frames_total
+        if self.on_frames_left is not None:
+            self.on_frames_left(self.frames_left() - left)
+        if frames_done:
+            self.first_frame.set()
+
+    def frames_left(self):
+        return max(self.frames_estimate, self.frames_total) - self.frames_done
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": {"frames_done": self.frames_done, "frames_total": self.frames_total},
+            "error": self.error,
+            "followers": self.followers,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, num_slots=1, max_queue=None, max_wait=None, fps=10.0, max_finished=1000, finished_ttl=3600):
+        # max_queue: queued (not running) jobs accepted at most, None = unbounded
+        # max_wait: reject new jobs whose estimated wait is over this many seconds, None = never
+        # fps: frames/s per slot assumed until the first job finished
+        # max_finished, finished_ttl: finished jobs kept at most / seconds after they ended
+        self.num_slots = num_slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.fps = fps
+        self.queue = Queue()
+        self.jobs = {}
+        self.inflight = {} # key -> queued / running job, for single flight
+        self.done_at = OrderedDict() # job id -> finished_at, in the order jobs ended
+        self.expired_ids = OrderedDict() # ids of forgotten jobs (the last max_finished of them), for 410s
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.last_queue_wait = 0.0 # seconds the last started job sat in the queue
+        self.frames_pending = 0 # frames still to render by queued / running jobs, for the wait estimate
+
+        self.workers = [threading.Thread(target=self._work, name=f"render-slot-{i}", daemon=True) for i in range(num_slots)]
+        for w in self.workers:
+            w.start()
+
+    def submit(self, fn, *args, frames=0, key=None, **kwargs):
+        # fn(job, *args, **kwargs) runs on a render slot and returns the result path.
+        # frames: expected number of video frames, for the wait estimate. raises Overloaded.
+        # key: identical requests in flight share one job (no new work, so no admission check)
+        job = Job(fn, args, kwargs, frames, key)
+        with self.lock:
+            if key is not None and key in self.inflight:
+                leader = self.inflight[key]
+                leader.followers += 1
+                self.coalesced += 1
+                return leader
+            if self.max_queue is not None and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("queue full", self._retry_after(self._estimated_wait()), status_code=503)
+            wait = self._estimated_wait()
+            if self.max_wait is not None and wait > self.max_wait:
+                self.rejected += 1
+                raise Overloaded(f"estimated wait {wait:.0f}s", self._retry_after(wait), status_code=429)
+            self.jobs[job.id] = job
+            if key is not None:
+                self.inflight[key] = job
+            self.queued += 1
+            self.frames_pending += job.frames_left()
+            job.on_frames_left = self._frames_left_changed
+        self.queue.put(job)
+        return job
+
+    def complete(self, result):
+        # register an already finished job (e.g. a result cache hit), skipping the queue
+        job = Job(None, (), {})
+        job.status = Job.DONE
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        job.first_frame.set()
+        job.finished.set()
+        with self.lock:
+            self.jobs[job.id] = job
+            self._finish(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    def expired(self, job_id):
+        # a finished job forgotten by now (as opposed to an id that never existed)
+        with self.lock:
+            self._expire()
+            return job_id in self.expired_ids
+
+    def estimated_wait(self):
+        # seconds until a job submitted now would start
+        with self.lock:
+            return self._estimated_wait()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "slots": self.num_slots,
+                "queued": self.queued,
+                "running": self.running,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "fps_per_slot": self.fps,
+                "estimated_wait": self._estimated_wait(),
+                "last_queue_wait": self.last_queue_wait,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "inflight_keys": len(self.inflight),
+                "finished_kept": len(self.done_at),
+            }
+
+    def _estimated_wait(self):
+        # all frames still to render ahead of a new job, over the measured throughput of all slots.
+        # no wait while a slot is free.
+        if self.queued + self.running < self.num_slots:
+            return 0.0
+        return self.frames_pending / (self.fps * self.num_slots)
+
+    def _frames_left_changed(self, delta):
+        with self.lock:
+            self.frames_pending += delta
+
+    def _finish(self, job):
+        # under the lock: job ended, it is kept until it expires
+        self.done_at[job.id] = job.finished_at
+        self._expire()
+
+    def _expire(self):
+        # under the lock: forget the finished jobs over the ttl / count
+        now = time.time()
+        while self.done_at:
+            job_id, finished_at = next(iter(self.done_at.items()))
+            if len(self.done_at) <= self.max_finished and now - finished_at <= self.finished_ttl:
+                break
+            del self.done_at[job_id]
+            del self.jobs[job_id]
+            self.expired_ids[job_id] = None
+            if len(self.expired_ids) > self.max_finished:
+                self.expired_ids.popitem(last=False)
+
+    def _retry_after(self, wait):
+        # when the backlog should be back under max_wait
+        return max(1, math.ceil(wait - (self.max_wait or 0)))
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = Job.RUNNING
+            job.started_at = time.time()
+            queue_wait = job.started_at - job.created_at
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.last_queue_wait = queue_wait
+            QUEUE_WAIT_SECONDS.observe(queue_wait)
+            try:
+                job.result = job.fn(job, *job.args, **job.kwargs)
+                job.status = Job.DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.error = str(e)[-4000:]
+                job.status = Job.FAILED
+            finally:
+                job.finished_at = time.time()
+                with self.lock:
+                    self.running -= 1
+                    job.on_frames_left = None
+                    self.frames_pending -= job.frames_left()
+                    if job.key is not None and self.inflight.get(job.key) is job:
+                        del self.inflight[job.key]
+                    if job.status == Job.DONE and job.frames_done > 0:
+                        # moving average of the per-slot render speed (includes TTS and encoding)
+                        fps = job.frames_done / max(job.finished_at - job.started_at, 1e-3)
+                        self.fps = 0.8 * self.fps + 0.2 * fps
+                    self._finish(job)
+                job.first_frame.set()
+                job.finished.set()
+                self.queue.task_done()
@@ -11,8 +11,10 @@ try:
     torch.backends.cudnn.allow_tf32 = False
 except AttributeError as e:
     print('Info. This pytorch version is not support with tf32.')
-    
-if __name__ == '__main__':
+
+
+def get_opt(args=None):
+    # args=None parses sys.argv, a list of strings lets other modules (e.g. render_engine.py) build the same opt in-process.
 
     parser = argparse.ArgumentParser()
     parser.add_argument('path', type=str)
@@ -110,6 +112,7 @@ if __name__ == '__main__':
     parser.add_argument('--asr_model', type=str, default='deepspeech')
 
     parser.add_argument('--asr_save_feats', action='store_true')
+    parser.add_argument('--asr_incremental', action='store_true', help="wav2vec: only run new audio through the conv feature encoder, reuse its outputs for the left stride")
     # audio FPS
     parser.add_argument('--fps', type=int, default=50)
     # sliding window left-middle-right length (unit: 20ms)
@@ -117,7 +120,7 @@ if __name__ == '__main__':
     parser.add_argument('-m', type=int, default=50)
     parser.add_argument('-r', type=int, default=10)
 
-    opt = parser.parse_args()
+    opt = parser.parse_args(args)
 
     if opt.O:
         opt.fp16 = True
@@ -138,7 +141,14 @@ if __name__ == '__main__':
     # if opt.finetune_lips:
     #     # do not update density grid in finetune stage
     #     opt.update_extra_interval = 1e9
-    
+
+    return opt
+
+
+if __name__ == '__main__':
+
+    opt = get_opt()
+
     print(opt)
     
     seed_everything(opt.seed)
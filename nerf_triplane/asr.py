@@ -4,13 +4,18 @@ import torch
 import torch.nn.functional as F
 from transformers import AutoModelForCTC, AutoProcessor
 
-import pyaudio
 import soundfile as sf
 import resampy
 
+from collections import deque
 from queue import Queue
 from threading import Thread, Event
 
+try:
+    from .telemetry import ASR_STEP_SECONDS
+except ImportError: # run as a script, python nerf_triplane/asr.py
+    from telemetry import ASR_STEP_SECONDS
+
 
 def _read_frame(stream, exit_event, queue, chunk):
 
@@ -32,10 +37,84 @@ def _play_frame(stream, exit_event, queue, chunk):
         frame = (frame * 32767).astype(np.int16).tobytes()
         stream.write(frame, chunk)
 
+
+def read_wav(path, sample_rate=16000):
+    # mono float32 PCM at sample_rate, as ASR's file mode reads it
+    stream, sr = sf.read(path) # [T*sample_rate,] float64
+    stream = stream.astype(np.float32)
+
+    if stream.ndim > 1:
+        print(f'[WARN] audio has {stream.shape[1]} channels, only use the first.')
+        stream = stream[:, 0]
+
+    if sr != sample_rate:
+        print(f'[WARN] audio sample rate is {sr}, resampling into {sample_rate}.')
+        stream = resampy.resample(x=stream, sr_orig=sr, sr_new=sample_rate)
+
+    return stream
+
+
+def unfold_feats(feats, window_size=16):
+    # [M, C] logits (20 ms steps) --> [M / 2 + 1, window_size, C], a window per 40 ms video frame (--asr_save_feats)
+    audio_dim = feats.shape[-1]
+    if feats.numel() == 0: # no logits at all (audio shorter than the receptive field)
+        return feats.new_zeros(0, window_size, audio_dim)
+    padding = window_size // 2
+    feats = feats.view(-1, audio_dim).permute(1, 0).contiguous() # [C, M]
+    feats = feats.view(1, audio_dim, -1, 1) # [1, C, M, 1]
+    unfolded = F.unfold(feats, kernel_size=(window_size, 1), padding=(padding, 0), stride=(2, 1)) # [1, C * window_size, M / 2 + 1]
+    return unfolded.view(audio_dim, window_size, -1).permute(2, 1, 0).contiguous() # [C, window_size, M / 2 + 1] --> [M / 2 + 1, window_size, C]
+
+
+def feats_path(wav, asr_model):
+    # where --asr_save_feats puts the features of wav
+    if 'esperanto' in asr_model:
+        return wav.replace('.wav', '_eo.npy')
+    return wav.replace('.wav', '.npy')
+
+
+def extract_feats(speech, processor, model, l=10, m=50, r=10, chunk=320, batch_size=16, sample_rate=16000):
+    # offline: the [M, 16, C] features of ASR's file mode (--asr_save_feats) for the PCM speech, without the
+    # 20 ms stepping. the same (l + m + r) chunk windows, stride cutting and final window, but every window is
+    # known upfront, so they go through the model batch_size at a time. returns a tensor on the model device.
+    device = next(model.parameters()).device
+    size = l + m + r
+    padded = np.concatenate([np.zeros(l * chunk, dtype=np.float32), speech.astype(np.float32)]) # left pad, as ASR
+    chunks = l + int(np.ceil(speech.shape[0] / chunk)) # the last one may be short
+
+    # windows the stream fills: chunks [k * m, k * m + size), then the rest at the end of the stream
+    n_full = (chunks - size) // m + 1 if chunks >= size else 0
+    windows = [padded[k * m * chunk:(k * m + size) * chunk] for k in range(n_full)]
+    windows.append(padded[n_full * m * chunk:])
+
+    logits = []
+    i = 0
+    while i < len(windows):
+        # a batch of equal lengths (a short last chunk changes the length), the processor normalizes each window
+        j = i + 1
+        while j < min(len(windows), i + batch_size) and windows[j].shape[0] == windows[i].shape[0]:
+            j += 1
+        inputs = processor(windows[i:j], sampling_rate=sample_rate, return_tensors="pt", padding=True)
+        with torch.no_grad():
+            batch = model(inputs.input_values.to(device)).logits # [B, N - 1, C]
+        for k in range(i, j):
+            out = batch[k - i]
+            # cut off stride, the last window (end of stream) keeps its right
+            right = out.shape[0] if k == len(windows) - 1 else min(out.shape[0], out.shape[0] - r + 1)
+            logits.append(out[l:right])
+        i = j
+
+    return unfold_feats(torch.cat(logits, dim=0))
+
 class ASR:
-    def __init__(self, opt):
+    def __init__(self, opt, processor=None, model=None, collect_feats=False):
+        # processor, model: already loaded ones to reuse (audio_features keeps them resident)
+        # collect_feats: keep the [M, 16, C] windowed features of the whole input in self.feats when terminated
+        #   (also on with --asr_save_feats, which saves them next to the wav)
 
         self.opt = opt
+        self.collect_feats = opt.asr_save_feats or collect_feats
+        self.feats = None
 
         self.play = opt.asr_play
 
@@ -45,7 +124,9 @@ class ASR:
         self.chunk = self.sample_rate // self.fps # 320 samples per chunk (20ms * 16000 / 1000)
         self.mode = 'live' if opt.asr_wav == '' else 'file'
 
-        if 'esperanto' in self.opt.asr_model:
+        if self.opt.asr_model == 'ave':
+            self.audio_dim = 512
+        elif 'esperanto' in self.opt.asr_model:
             self.audio_dim = 44
         elif 'deepspeech' in self.opt.asr_model:
             self.audio_dim = 29
@@ -67,7 +148,10 @@ class ASR:
 
 
         self.exit_event = Event()
-        self.audio_instance = pyaudio.PyAudio()
+        self.audio_instance = None
+        if self.mode != 'file' or self.play:
+            import pyaudio # microphone / playback only, wav files (and extract_feats) do not need it
+            self.audio_instance = pyaudio.PyAudio()
 
         # create input stream
         if self.mode == 'file':
@@ -87,13 +171,53 @@ class ASR:
         # current location of audio
         self.idx = 0
 
-        # create wav2vec model
-        print(f'[INFO] loading ASR model {self.opt.asr_model}...')
-        self.processor = AutoProcessor.from_pretrained(opt.asr_model)
-        self.model = AutoModelForCTC.from_pretrained(opt.asr_model).to(self.device)
+        # real-time factor: network seconds per second of audio, printed every rtf_interval seconds of audio
+        self.audio_seconds = 0.
+        self.compute_seconds = 0.
+        self.rtf_interval = 10
+        self.rtf_next = self.rtf_interval
+
+        self.incremental = False
+        self.norm_deviation = None # --asr_incremental with do_normalize: max logit difference to a full forward
+
+        if self.opt.asr_model == 'ave':
+            # AVE: streaming mel front-end + the resident AVE encoder, one [1, 512] feature per 25 fps video frame
+            from .audio_features import get_extractor
+            from .utils import StreamingMel
+            print(f'[INFO] loading AVE audio encoder...')
+            self.ave = get_extractor('ave', self.device).model
+            self.mel = StreamingMel()
+            self.ave_feats = deque() # encoded, not yet consumed by get_next_feat
+            if self.collect_feats:
+                print(f'[WARN] --asr_save_feats is for wav2vec models, use data_utils/process.py for AVE features.')
+                self.collect_feats = False
+        else:
+            # create wav2vec model
+            print(f'[INFO] loading ASR model {self.opt.asr_model}...')
+            self.processor = processor if processor is not None else AutoProcessor.from_pretrained(opt.asr_model)
+            self.model = model if model is not None else AutoModelForCTC.from_pretrained(opt.asr_model).to(self.device)
+            self.device = next(self.model.parameters()).device
+
+            # incremental: only new samples go through the conv feature encoder (see incremental_logits)
+            self.incremental = opt.asr_incremental
+            config = self.model.config
+            if self.incremental and getattr(config, 'feat_extract_norm', 'layer') != 'layer':
+                print(f'[WARN] {opt.asr_model} normalizes conv features over the whole window (feat_extract_norm={config.feat_extract_norm}), --asr_incremental disabled.')
+                self.incremental = False
+            if self.incremental:
+                self.conv_stride = int(np.prod(config.conv_stride)) # 320 samples
+                self.conv_field = 1 + sum((k - 1) * int(np.prod(config.conv_stride[:i])) for i, k in enumerate(config.conv_kernel)) # 400 samples
+                self.conv_input = torch.zeros(0) # samples the conv encoder has not consumed yet (its overlap)
+                self.conv_feats = None # conv encoder outputs of the current window, [T, 512]
+                self.fed_frames = 0 # chunks at the start of self.frames already fed to the conv encoder
+                self.do_normalize = getattr(getattr(self.processor, 'feature_extractor', self.processor), 'do_normalize', False)
+                self.norm_stats = (0, 0., 0.) # count, mean, M2 of the stream so far
+                if self.do_normalize:
+                    print(f'[WARN] {opt.asr_model} normalizes every window (do_normalize), --asr_incremental uses the running '
+                          f'statistics of the stream instead: features deviate slightly from full windows, reported with the RTF.')
 
         # prepare to save logits
-        if self.opt.asr_save_feats:
+        if self.collect_feats:
             self.all_feats = []
 
         # the extracted features 
@@ -107,9 +231,17 @@ class ASR:
         self.tail = 8
         # attention window...
         self.att_feats = [torch.zeros(self.audio_dim, 16, dtype=torch.float32, device=self.device)] * 4 # 4 zero padding...
+        if self.opt.asr_model == 'ave':
+            self.att_feats = [torch.zeros(1, self.audio_dim, dtype=torch.float32, device=self.device)] * 4
+        # row numbers of att_feats (padding negative), att_index is the window last returned by get_next_feat
+        self.att_rows = list(range(-4, 0))
+        self.att_index = None
 
         # warm up steps needed: mid + right + window_size + attention_size
         self.warm_up_steps = self.context_size + self.stride_right_size + 8 + 2 * 3
+        if self.opt.asr_model == 'ave':
+            # first 16 mel steps + attention_size
+            self.warm_up_steps = int(np.ceil(15 * self.mel.hop / self.chunk)) + 2 * 4
 
         self.listening = False
         self.playing = False
@@ -161,6 +293,12 @@ class ASR:
         # return a [1/8, 16] window, for the next input to nerf side.
         
         while len(self.att_feats) < 8:
+            if self.opt.asr_model == 'ave':
+                # hold the last feature if the audio is late
+                self.att_feats.append(self.ave_feats.popleft() if self.ave_feats else self.att_feats[-1])
+                self.att_rows.append(self.att_rows[-1] + 1)
+                continue
+
             # [------f+++t-----]
             if self.front < self.tail:
                 feat = self.feat_queue[self.front:self.tail]
@@ -174,11 +312,14 @@ class ASR:
             # print(self.front, self.tail, feat.shape)
 
             self.att_feats.append(feat.permute(1, 0))
+            self.att_rows.append(self.att_rows[-1] + 1)
         
         att_feat = torch.stack(self.att_feats, dim=0) # [8, 44, 16]
+        self.att_index = torch.tensor(self.att_rows)
 
         # discard old
         self.att_feats = self.att_feats[1:]
+        self.att_rows = self.att_rows[1:]
 
         return att_feat
 
@@ -187,6 +328,9 @@ class ASR:
         if self.terminated:
             return
 
+        if self.opt.asr_model == 'ave':
+            return self.run_step_ave()
+
         # get a frame of audio
         frame = self.get_audio_frame()
         
@@ -196,6 +340,7 @@ class ASR:
             self.terminated = True
         else:
             self.frames.append(frame)
+            self.audio_seconds += frame.shape[0] / self.sample_rate
             # put to output
             if self.play:
                 self.output_queue.put(frame)
@@ -204,16 +349,27 @@ class ASR:
                 return
         
         inputs = np.concatenate(self.frames) # [N * chunk]
+        new = np.concatenate(self.frames[self.fed_frames:] or [np.zeros(0, dtype=np.float32)]) if self.incremental else None
 
         # discard the old part to save memory
         if not self.terminated:
             self.frames = self.frames[-(self.stride_left_size + self.stride_right_size):]
-
-        logits, labels, text = self.frame_to_text(inputs)
+            if self.incremental:
+                self.fed_frames = len(self.frames)
+
+        t = time.perf_counter()
+        logits, labels, text = self.frame_to_text(inputs, new)
+        seconds = time.perf_counter() - t
+        if self.incremental and self.do_normalize and (self.audio_seconds >= self.rtf_next or self.terminated) \
+                and inputs.shape[0] >= self.conv_field:
+            # measure what the running normalization costs, on the windows the RTF is reported for (not timed)
+            full_logits, _, _ = self.frame_to_text(inputs)
+            self.norm_deviation = (logits - full_logits).abs().max().item()
+        self.report_rtf(seconds)
         feats = logits # better lips-sync than labels
 
         # save feats
-        if self.opt.asr_save_feats:
+        if self.collect_feats:
             self.all_feats.append(feats)
 
         # record the feats efficiently.. (no concat, constant memory)
@@ -230,37 +386,53 @@ class ASR:
         if self.terminated:
             self.text += '\n[END]'
             print(self.text)
+            if self.collect_feats:
+                self.feats = unfold_feats(torch.cat(self.all_feats, dim=0)) # [N, C] --> [M, 16, C]
             if self.opt.asr_save_feats:
                 print(f'[INFO] save all feats for training purpose... ')
-                feats = torch.cat(self.all_feats, dim=0) # [N, C]
-                # print('[INFO] before unfold', feats.shape)
-                window_size = 16
-                padding = window_size // 2
-                feats = feats.view(-1, self.audio_dim).permute(1, 0).contiguous() # [C, M]
-                feats = feats.view(1, self.audio_dim, -1, 1) # [1, C, M, 1]
-                unfold_feats = F.unfold(feats, kernel_size=(window_size, 1), padding=(padding, 0), stride=(2, 1)) # [1, C * window_size, M / 2 + 1]
-                unfold_feats = unfold_feats.view(self.audio_dim, window_size, -1).permute(2, 1, 0).contiguous() # [C, window_size, M / 2 + 1] --> [M / 2 + 1, window_size, C]
-                # print('[INFO] after unfold', unfold_feats.shape)
                 # save to a npy file
-                if 'esperanto' in self.opt.asr_model:
-                    output_path = self.opt.asr_wav.replace('.wav', '_eo.npy')
-                else:
-                    output_path = self.opt.asr_wav.replace('.wav', '.npy')
-                np.save(output_path, unfold_feats.cpu().numpy())
+                output_path = feats_path(self.opt.asr_wav, self.opt.asr_model)
+                np.save(output_path, self.feats.cpu().numpy())
                 print(f"[INFO] saved logits to {output_path}")
     
-    def create_file_stream(self):
-    
-        stream, sample_rate = sf.read(self.opt.asr_wav) # [T*sample_rate,] float64
-        stream = stream.astype(np.float32)
+    def run_step_ave(self):
+        # a chunk only computes its own mel steps, the encoder runs on the AVE windows it completes
+        frame = self.get_audio_frame()
+
+        t = time.perf_counter()
+        if frame is None:
+            self.terminated = True
+            windows = self.mel.flush()
+        else:
+            self.audio_seconds += frame.shape[0] / self.sample_rate
+            if self.play:
+                self.output_queue.put(frame)
+            windows = self.mel.push(frame)
+
+        if windows:
+            mel = torch.from_numpy(np.stack(windows)).unsqueeze(1).to(self.device) # [B, 1, 80, 16]
+            with torch.no_grad():
+                feats = self.ave(mel) # [B, 512]
+            self.ave_feats.extend(feats.unsqueeze(1)) # [1, 512] each
+        self.report_rtf(time.perf_counter() - t, observe=False)
+
+    def report_rtf(self, seconds, observe=True):
+        # seconds: network time of this step. keeping up with live audio needs rtf < 1.
+        self.compute_seconds += seconds
+        if observe:
+            ASR_STEP_SECONDS.observe(seconds, mode='incremental' if self.incremental else 'full')
+        if self.audio_seconds >= self.rtf_next or self.terminated:
+            deviation = f', max logit deviation from full windows {self.norm_deviation:.2e}' if self.norm_deviation is not None else ''
+            print(f'[INFO] ASR real-time factor {self.rtf:.3f} over {self.audio_seconds:.1f}s of audio ({self.opt.asr_model}{", incremental" if self.incremental else ""}{deviation})')
+            self.rtf_next = self.audio_seconds + self.rtf_interval
+
+    @property
+    def rtf(self):
+        return self.compute_seconds / max(self.audio_seconds, 1e-6)
 
-        if stream.ndim > 1:
-            print(f'[WARN] audio has {stream.shape[1]} channels, only use the first.')
-            stream = stream[:, 0]
+    def create_file_stream(self):
     
-        if sample_rate != self.sample_rate:
-            print(f'[WARN] audio sample rate is {sample_rate}, resampling into {self.sample_rate}.')
-            stream = resampy.resample(x=stream, sr_orig=sample_rate, sr_new=self.sample_rate)
+        stream = read_wav(self.opt.asr_wav, self.sample_rate)
 
         print(f'[INFO] loaded audio stream {self.opt.asr_wav}: {stream.shape}')
 
@@ -317,14 +489,58 @@ class ASR:
             return frame
 
         
-    def frame_to_text(self, frame):
+    def normalize(self, x):
+        # the processor's zero mean / unit variance normalization, with the running statistics of the stream
+        # (a full forward normalizes every window by its own, the conv outputs of the overlap would change)
+        if not self.do_normalize or x.shape[0] == 0:
+            return x.astype(np.float32)
+        n, mean, m2 = self.norm_stats
+        n_x, mean_x = x.shape[0], x.mean(dtype=np.float64)
+        delta = mean_x - mean
+        total = n + n_x
+        mean = mean + delta * n_x / total
+        m2 = m2 + ((x - mean_x) ** 2).sum(dtype=np.float64) + delta ** 2 * n * n_x / total
+        self.norm_stats = (total, mean, m2)
+        return ((x - mean) / np.sqrt(m2 / total + 1e-7)).astype(np.float32)
+
+    def incremental_logits(self, length, new):
+        # wav2vec forward of a window of `length` samples ending with the samples `new`: only these go through
+        # the conv feature encoder, its outputs for the rest of the window (the left stride and the right stride
+        # of the previous step) are cached from earlier steps. the transformer still sees the whole window.
+        base = getattr(self.model, self.model.base_model_prefix)
+        self.conv_input = torch.cat([self.conv_input, torch.from_numpy(self.normalize(new))])
+        n_out = (length - self.conv_field) // self.conv_stride + 1 # conv outputs of the window, as in a full forward
+
+        with torch.no_grad():
+            if self.conv_feats is None and self.conv_input.shape[0] < self.conv_field:
+                # the stream so far is shorter than the receptive field: no conv output, no logits yet
+                return torch.zeros(1, 0, self.model.config.vocab_size, device=self.device)
+            if self.conv_input.shape[0] >= self.conv_field:
+                feats = base.feature_extractor(self.conv_input[None].to(self.device))[0].transpose(0, 1) # [T, 512]
+                self.conv_input = self.conv_input[feats.shape[0] * self.conv_stride:]
+                self.conv_feats = feats if self.conv_feats is None else torch.cat([self.conv_feats, feats], dim=0)
+            self.conv_feats = self.conv_feats[-n_out:]
+
+            hidden = base.feature_projection(self.conv_feats[None])
+            if isinstance(hidden, tuple): # wav2vec2 also returns the normed conv features
+                hidden = hidden[0]
+            hidden = base.encoder(hidden)[0]
+            if getattr(base, 'adapter', None) is not None:
+                hidden = base.adapter(hidden)
+            return self.model.lm_head(hidden) # [1, N - 1, 32]
+
+    def frame_to_text(self, frame, new=None):
         # frame: [N * 320], N = (context_size + 2 * stride_size)
+        # new: --asr_incremental, the samples at the end of frame the conv encoder has not seen
         
-        inputs = self.processor(frame, sampling_rate=self.sample_rate, return_tensors="pt", padding=True)
-        
-        with torch.no_grad():
-            result = self.model(inputs.input_values.to(self.device))
-            logits = result.logits # [1, N - 1, 32]
+        if new is not None:
+            logits = self.incremental_logits(frame.shape[0], new)
+        else:
+            inputs = self.processor(frame, sampling_rate=self.sample_rate, return_tensors="pt", padding=True)
+
+            with torch.no_grad():
+                result = self.model(inputs.input_values.to(self.device))
+                logits = result.logits # [1, N - 1, 32]
         
         # cut off stride
         left = max(0, self.stride_left_size)
@@ -397,6 +613,11 @@ if __name__ == '__main__':
     # parser.add_argument('--model', type=str, default='facebook/wav2vec2-large-960h-lv60-self')
 
     parser.add_argument('--save_feats', action='store_true')
+    parser.add_argument('--incremental', action='store_true', help="only run new audio through the conv feature encoder")
+    # offline: python nerf_triplane/asr.py --wav data/<name>/aud.wav --bulk  ->  the --save_feats npy, batched
+    parser.add_argument('--bulk', action='store_true', help="extract the features of the whole wav in batches of windows, saves them")
+    parser.add_argument('--batch', type=int, default=16, help="windows per forward in --bulk")
+    parser.add_argument('--check', action='store_true', help="compare --bulk features with the streaming path, saves nothing")
     # audio FPS
     parser.add_argument('--fps', type=int, default=50)
     # sliding window left-middle-right length.
@@ -411,9 +632,37 @@ if __name__ == '__main__':
     opt.asr_play = opt.play
     opt.asr_model = opt.model
     opt.asr_save_feats = opt.save_feats
+    opt.asr_incremental = opt.incremental
 
     if 'deepspeech' in opt.asr_model:
         raise ValueError("DeepSpeech features should not use this code to extract...")
 
-    with ASR(opt) as asr:
-        asr.run()
\ No newline at end of file
+    if opt.bulk or opt.check:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        print(f'[INFO] loading ASR model {opt.asr_model}...')
+        processor = AutoProcessor.from_pretrained(opt.asr_model)
+        model = AutoModelForCTC.from_pretrained(opt.asr_model).to(device).eval()
+
+        t = time.time()
+        feats = extract_feats(read_wav(opt.asr_wav), processor, model, opt.l, opt.m, opt.r, chunk=16000 // opt.fps, batch_size=opt.batch)
+        t_bulk = time.time() - t
+        print(f'[INFO] bulk features {tuple(feats.shape)} in {t_bulk:.2f}s')
+
+        if opt.check:
+            opt.asr_save_feats = False
+            t = time.time()
+            with ASR(opt, processor=processor, model=model, collect_feats=True) as asr:
+                asr.run()
+            t_stream = time.time() - t
+            diff = (feats - asr.feats).abs().max().item() if feats.shape == asr.feats.shape else float('inf')
+            print(f'[INFO] streaming features {tuple(asr.feats.shape)} in {t_stream:.2f}s, bulk is {t_stream / t_bulk:.1f}x faster')
+            print(f'[INFO] max abs difference {diff:.2e} (features up to {asr.feats.abs().max().item():.2f})')
+            if diff > 1e-3:
+                raise SystemExit('[ERROR] bulk features differ from the streaming path')
+        else:
+            output_path = feats_path(opt.asr_wav, opt.asr_model)
+            np.save(output_path, feats.cpu().numpy())
+            print(f"[INFO] saved logits to {output_path}")
+    else:
+        with ASR(opt) as asr:
+            asr.run()
\ No newline at end of file
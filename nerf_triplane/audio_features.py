@@ -0,0 +1,344 @@
+# audio_features.py
+"""
+One API for offline audio features, whatever --asr_model a workspace uses.
+
+    extractor = get_extractor('ave')                    # model loaded on first use, then resident
+    feats = extractor.extract('data/May/aud.wav')       # numpy, in the layout NeRFDataset loads
+    extractor.save('data/May/aud.wav')                  # -> data/May/aud_hu.npy etc. (data preparation)
+
+mode        features                            file NeRFDataset loads
+ave         [N + 4, 512]                        none, extracted on the fly (+ on-disk AVE cache)
+hubert      [N, 2, 1024]                        aud_hu.npy
+wav2vec     [M, 16, 44] esperanto / [M, 16, 32] aud_eo.npy / aud.npy
+deepspeech  [N, 16, 29]                         aud_ds.npy
+
+The encoder work is split into batches (AVE mel windows, wav2vec context
+windows) sized from the memory free on the device, measured once per
+extractor with a probe batch, unless `batch_size` is given. HuBERT runs on
+fixed clips of 1000 steps: its features depend on where clips start, so the
+clip length must not follow free memory. wav2vec goes through the batched offline mode of
+nerf_triplane/asr.py (extract_feats), DeepSpeech through the TF graph of
+data_utils/deepspeech_features (one pass per utterance).
+"""
+import io
+import os
+import sys
+import time
+import hashlib
+import threading
+
+import numpy as np
+import torch
+
+from .telemetry import AVE_SECONDS
+from disk_cache import DiskCache, cache_key
+
+AVE_CKPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints', 'audio_visual_encoder.pth')
+
+# AVE features persist across runs, keyed by (wav content, encoder checkpoint), as .npy loaded with mmap.
+# AVE_CACHE_DIR='' disables it.
+AVE_CACHE_DIR = os.environ.get('AVE_CACHE_DIR', os.path.join(os.path.dirname(AVE_CKPT_PATH), 'ave_cache'))
+AVE_CACHE_BYTES = int(os.environ.get('AVE_CACHE_BYTES', str(1 << 30)))
+_ave_cache = None
+_ave_ckpt_hash = None
+_ave_lock = threading.Lock() # render engines extract concurrently
+
+# batch autotuning: share of the free memory a batch may use, and bounds
+MEMORY_FRACTION = float(os.environ.get('AUDIO_FEATURES_MEMORY_FRACTION', '0.25'))
+MAX_BATCH = int(os.environ.get('AUDIO_FEATURES_MAX_BATCH', '1024'))
+
+HUBERT_MODEL = 'facebook/hubert-large-ls960-ft'
+WAV2VEC_MODEL = 'cpierse/wav2vec2-large-xlsr-53-esperanto'
+DEEPSPEECH_PB = '~/.tensorflow/models/deepspeech-0_1_0-b90017e8.pb'
+
+
+def load_ave_encoder(device=None):
+    # the Audio Visual Encoder, load once and pass it around to avoid reloading the checkpoint.
+    # .network / .utils are imported here: they pull in raymarching, lpips, mcubes ... which hubert / wav2vec /
+    # deepspeech extraction (data_utils) does not need
+    from .network import AudioEncoder
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = AudioEncoder().to(device).eval()
+    ckpt = torch.load(AVE_CKPT_PATH, map_location=device)
+    model.load_state_dict({f'audio_encoder.{k}': v for k, v in ckpt.items()})
+    return model
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def ave_cache():
+    global _ave_cache
+    with _ave_lock:
+        if _ave_cache is None and AVE_CACHE_DIR:
+            _ave_cache = DiskCache(AVE_CACHE_DIR, max_bytes=AVE_CACHE_BYTES, suffix='.npy')
+        return _ave_cache
+
+
+def ave_cache_key(wav_path):
+    # (wav content, encoder checkpoint) -> cache key. PCM arrays are hashed as float32 samples.
+    global _ave_ckpt_hash
+    with _ave_lock:
+        if _ave_ckpt_hash is None:
+            _ave_ckpt_hash = file_sha256(AVE_CKPT_PATH)
+    if isinstance(wav_path, np.ndarray):
+        wav_hash = hashlib.sha256(np.ascontiguousarray(wav_path, dtype=np.float32).tobytes()).hexdigest()
+    else:
+        wav_hash = file_sha256(wav_path)
+    return cache_key({'wav': wav_hash, 'encoder': _ave_ckpt_hash, 'features': 'ave_padded'})
+
+
+def extract_ave_features(wav_path, model=None, batch_size=64, use_cache=True):
+    # wav --> [N + 4, 512] AVE features (first and last frame repeated twice as padding)
+    # wav_path: wav file, or mono float PCM at 16 kHz
+    # model: an AVE encoder, None = the resident one of get_extractor('ave') (batch size from free memory)
+    # use_cache: look up / store the features in the on-disk AVE cache, a hit skips the encoder (and loading it)
+    if model is None:
+        extractor = get_extractor('ave')
+    else:
+        extractor = AudioFeatureExtractor('ave', model=model, batch_size=batch_size)
+    return extractor.extract(wav_path, use_cache=use_cache)
+
+
+def free_memory(device):
+    # bytes free on a cuda device, or available host memory
+    if device.type == 'cuda':
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        return 4 << 30
+
+
+def probe_bytes_per_item(fn, items, device, cpu_estimate):
+    # peak memory of running fn(items) over its number of items (cuda), or a fixed estimate (cpu)
+    if device.type != 'cuda':
+        return cpu_estimate
+    torch.cuda.synchronize(device)
+    base = torch.cuda.memory_allocated(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    with torch.no_grad():
+        fn(items)
+    torch.cuda.synchronize(device)
+    return max((torch.cuda.max_memory_allocated(device) - base) / items, 1)
+
+
+def load_16k(wav):
+    # path or mono float PCM -> mono float32 PCM at 16 kHz
+    if isinstance(wav, np.ndarray):
+        return wav.astype(np.float32)
+    import soundfile as sf
+    speech, sr = sf.read(wav, dtype='float32')
+    if speech.ndim > 1:
+        speech = speech[:, 0]
+    if sr != 16000:
+        import librosa
+        speech = librosa.resample(speech, orig_sr=sr, target_sr=16000)
+    return speech
+
+
+class AudioFeatureExtractor:
+    MODES = ('ave', 'hubert', 'wav2vec', 'deepspeech')
+
+    def __init__(self, mode='ave', device=None, model=None, batch_size=None, model_name=None):
+        # model: an already loaded model to use (e.g. the AVE encoder shared by render engines)
+        # batch_size: fixed batch (ave: mel windows, wav2vec: context windows), None = from free memory
+        # model_name: hub model for hubert / wav2vec, frozen graph for deepspeech
+        assert mode in self.MODES, f'unknown audio feature mode {mode}, expected one of {self.MODES}'
+        self.mode = mode
+        self.device = torch.device(device) if device is not None else torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self._model = model
+        self.batch_size = batch_size
+        self.model_name = model_name or {'hubert': HUBERT_MODEL, 'wav2vec': WAV2VEC_MODEL, 'deepspeech': DEEPSPEECH_PB}.get(mode)
+        self.processor = None
+        self.lock = threading.Lock()
+
+    @property
+    def model(self):
+        # loaded on first use, then resident
+        with self.lock:
+            if self._model is None:
+                t = time.time()
+                self._model = getattr(self, f'_load_{self.mode}')()
+                print(f'[INFO] loaded {self.mode} audio feature model in {time.time() - t:.2f}s')
+            return self._model
+
+    def extract(self, wav, **kwargs):
+        # wav: path, or mono float PCM at 16 kHz -> numpy features (see the module docstring)
+        return getattr(self, f'_extract_{self.mode}')(wav, **kwargs)
+
+    def save(self, wav, out_path=None):
+        # features next to the wav, named as data_utils/process.py always did
+        stem = os.path.splitext(wav)[0]
+        if out_path is None:
+            suffix = {'ave': '_ave', 'hubert': '_hu', 'deepspeech': '_ds',
+                      'wav2vec': '_eo' if 'esperanto' in self.model_name else ''}[self.mode]
+            out_path = f'{stem}{suffix}.npy'
+        feats = self.extract(wav)
+        np.save(out_path, feats)
+        print(f'[INFO] saved {self.mode} features {feats.shape} to {out_path}')
+        return out_path
+
+    def tuned_batch(self):
+        # batch size from free memory, probed once (ave / wav2vec only, hubert clips are fixed)
+        assert self.mode in ('ave', 'wav2vec'), f'no batch autotuning for {self.mode}'
+        if self.batch_size is None:
+            model, device = self.model, self._device()
+            if self.mode == 'ave':
+                probe = 16
+                per_item = probe_bytes_per_item(lambda n: model(torch.zeros(n, 1, 80, 16, device=device)), probe, device, 1 << 20)
+            else:  # wav2vec: per context window of asr.extract_feats (70 x 20 ms)
+                probe = 4
+                per_item = probe_bytes_per_item(lambda n: model(torch.zeros(n, 70 * 320, device=device)), probe, device, 64 << 20)
+            batch = int(free_memory(device) * MEMORY_FRACTION / per_item)
+            self.batch_size = max(16 if self.mode == 'ave' else 1, min(MAX_BATCH, batch))
+            print(f'[INFO] {self.mode} batch size {self.batch_size} ({per_item / 2**10:.0f} KiB per item on {device})')
+        return self.batch_size
+
+    def _device(self):
+        params = getattr(self.model, 'parameters', None)
+        return next(params()).device if params is not None else self.device
+
+    # --- ave ---
+    def _load_ave(self):
+        return load_ave_encoder(self.device)
+
+    def _extract_ave(self, wav, use_cache=True):
+        t = time.perf_counter()
+        cache = ave_cache() if use_cache else None
+        if cache is not None:
+            key = ave_cache_key(wav)
+            path = cache.get(key)
+            if path is not None:
+                # copy-on-write mmap: pages are read lazily, and torch.from_numpy gets a writable array.
+                # the entry may be evicted (or be half written by another process) since get(): then it is a miss
+                try:
+                    aud_features = np.asarray(np.load(path, mmap_mode='c'))
+                except (OSError, ValueError) as e:
+                    print(f'[WARN] AVE cache entry {path} unreadable ({e}), extracting again')
+                else:
+                    AVE_SECONDS.observe(time.perf_counter() - t, cache='hit')
+                    return aud_features
+
+        # the encoder is only loaded (and the batch tuned) on a cache miss
+        from .utils import AudDataset
+        model = self.model
+        batch_size = self.tuned_batch()
+        device = self._device()
+
+        dataset = AudDataset(wav)
+        outputs = []
+        with torch.no_grad():
+            for mel in dataset.batches(batch_size, device):
+                outputs.append(model(mel))
+        outputs = torch.cat(outputs, dim=0).cpu()
+        first_frame, last_frame = outputs[:1], outputs[-1:]
+        aud_features = torch.cat([first_frame.repeat(2, 1), outputs, last_frame.repeat(2, 1)], dim=0).numpy()
+
+        if cache is not None:
+            buf = io.BytesIO()
+            np.save(buf, aud_features)
+            cache.put_bytes(key, buf.getvalue())
+        AVE_SECONDS.observe(time.perf_counter() - t, cache='miss' if cache is not None else 'off')
+        return aud_features
+
+    # --- hubert ---
+    def _load_hubert(self):
+        from transformers import Wav2Vec2Processor, HubertModel
+        self.processor = Wav2Vec2Processor.from_pretrained(self.model_name)
+        return HubertModel.from_pretrained(self.model_name).to(self.device).eval()
+
+    @torch.no_grad()
+    def _extract_hubert(self, wav):
+        # HuBERT's CNN is one big conv of kernel 400 / stride 320: clips of N steps overlap by kernel - stride samples.
+        # the transformer attends within a clip, so the clip length is fixed (the features must not depend on free memory)
+        model = self.model
+        device = self._device()
+        speech = load_16k(wav)
+        input_values_all = self.processor(speech, return_tensors='pt', sampling_rate=16000).input_values.to(device) # [1, T]
+        kernel, stride = 400, 320
+        clip_length = stride * 1000
+        expected_T = (input_values_all.shape[1] - (kernel - stride)) // stride
+
+        res_lst = []
+        for start_idx in range(0, input_values_all.shape[1], clip_length):
+            input_values = input_values_all[:, start_idx: start_idx + clip_length - stride + kernel]
+            if input_values.shape[1] < kernel: # shorter than the kernel, no step left
+                break
+            res_lst.append(model(input_values).last_hidden_state[0]) # [T, 1024]
+        ret = torch.cat(res_lst, dim=0).cpu()
+        assert abs(ret.shape[0] - expected_T) <= 1
+        if ret.shape[0] < expected_T:
+            ret = torch.nn.functional.pad(ret, (0, 0, 0, expected_T - ret.shape[0]))
+        else:
+            ret = ret[:expected_T]
+        # 50 Hz -> pairs of steps per 25 fps video frame
+        ret = ret[:ret.shape[0] // 2 * 2]
+        return ret.reshape(-1, 2, 1024).numpy()
+
+    # --- wav2vec (CTC logits, as nerf_triplane/asr.py --asr_save_feats, batched: asr.extract_feats) ---
+    def _load_wav2vec(self):
+        from transformers import AutoModelForCTC, AutoProcessor
+        self.processor = AutoProcessor.from_pretrained(self.model_name)
+        return AutoModelForCTC.from_pretrained(self.model_name).to(self.device).eval()
+
+    def _extract_wav2vec(self, wav):
+        from .asr import extract_feats, read_wav
+        model = self.model
+        speech = wav.astype(np.float32) if isinstance(wav, np.ndarray) else read_wav(wav)
+        return extract_feats(speech, self.processor, model, batch_size=self.tuned_batch()).cpu().numpy()
+
+    # --- deepspeech (tensorflow 1 frozen graph, one pass per utterance) ---
+    def _load_deepspeech(self):
+        ds_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_utils', 'deepspeech_features')
+        if ds_dir not in sys.path:
+            sys.path.append(ds_dir)
+        import tensorflow.compat.v1 as tf
+        from deepspeech_features import prepare_deepspeech_net
+        from deepspeech_store import get_deepspeech_model_file
+
+        pb_path = os.path.expanduser(self.model_name)
+        if not os.path.exists(pb_path):
+            pb_path = get_deepspeech_model_file()
+        graph, logits_ph, input_node_ph, input_lengths_ph = prepare_deepspeech_net(pb_path)
+        sess = tf.Session(graph=graph)
+        return lambda x: sess.run(logits_ph, feed_dict={input_node_ph: x[np.newaxis, ...], input_lengths_ph: [x.shape[0]]})
+
+    def _extract_deepspeech(self, wav):
+        from deepspeech_features import pure_conv_audio_to_deepspeech
+        net_fn = self.model
+        if isinstance(wav, np.ndarray):
+            # 16 kHz float PCM, quantized as the int16 wav it would have been written to
+            sample_rate, speech = 16000, (np.clip(wav, -1, 1) * 32767).astype(np.int16)
+        else:
+            # same input as conv_audios_to_deepspeech: the samples as stored (first channel), resampled
+            # by pure_conv_audio_to_deepspeech, so existing aud_ds.npy files and trained models match
+            from scipy.io import wavfile
+            sample_rate, speech = wavfile.read(wav)
+            if speech.ndim != 1:
+                speech = speech[:, 0]
+        ds = pure_conv_audio_to_deepspeech(audio=speech, audio_sample_rate=sample_rate, audio_window_size=1,
+                                           audio_window_stride=1, num_frames=None, net_fn=net_fn).reshape(-1, 29)
+        # 16-step windows, stride 2 (50 Hz -> 25 fps), zero padded by 8 on both ends
+        ds = np.concatenate([np.zeros((8, 29)), ds, np.zeros((8, 29))], axis=0)
+        return np.stack([ds[i:i + 16] for i in range(0, ds.shape[0] - 16, 2)])
+
+
+_extractors = {}
+_extractors_lock = threading.Lock()
+
+
+def get_extractor(mode='ave', device=None, **kwargs):
+    # resident extractor per (mode, device), shared by datasets, render engines and data preparation
+    device = torch.device(device) if device is not None else torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    with _extractors_lock:
+        key = (mode, str(device))
+        if key not in _extractors:
+            _extractors[key] = AudioFeatureExtractor(mode, device, **kwargs)
+        return _extractors[key]
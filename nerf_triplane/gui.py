@@ -96,6 +96,7 @@ class NeRFGUI:
 
         # audio features (from dataloader, only used in non-playing mode)
         self.audio_features = data_loader._data.auds # [N, 29, 16]
+        self.audio_windows = data_loader._data.aud_windows # [N, 8, 29, 16]
         self.audio_idx = 0
 
         # control eye
@@ -181,6 +182,7 @@ class NeRFGUI:
                 if self.opt.asr:
                     # use the live audio stream
                     data['auds'] = self.asr.get_next_feat()
+                    data['aud_rows'] = (self.asr, self.asr.att_index)
 
                 outputs = self.trainer.test_gui_with_data(data, self.W, self.H)
 
@@ -189,10 +191,12 @@ class NeRFGUI:
             
             else:
                 if self.audio_features is not None:
-                    auds = get_audio_features(self.audio_features, self.opt.att, self.audio_idx)
+                    auds = self.audio_windows[self.audio_idx]
+                    aud_rows = (self.audio_features, get_audio_index(self.audio_features.shape[0], self.opt.att, self.audio_idx))
                 else:
                     auds = None
-                outputs = self.trainer.test_gui(self.cam.pose, self.cam.intrinsics, self.W, self.H, auds, self.eye_area, self.ind_index, self.bg_color, self.spp, self.downscale)
+                    aud_rows = None
+                outputs = self.trainer.test_gui(self.cam.pose, self.cam.intrinsics, self.W, self.H, auds, self.eye_area, self.ind_index, self.bg_color, self.spp, self.downscale, aud_rows)
 
             ender.record()
             torch.cuda.synchronize()
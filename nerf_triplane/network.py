@@ -1,3 +1,5 @@
+import weakref
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -194,6 +196,10 @@ class NeRFNetwork(NeRFRenderer):
         if self.att > 0:
             self.audio_att_net = AudioAttNet(self.audio_dim)
 
+        # inference: audio_net outputs per feature row of an audio source (see audio_rows), dropped by train()
+        self.aud_tables = {} # id(clip features) -> [N + 1, audio_dim]
+        self.aud_streams = {} # id(live source) -> {row index: [audio_dim]}
+
         # DYNAMIC PART
         self.num_levels = 12
         self.level_dim = 1
@@ -303,17 +309,74 @@ class NeRFNetwork(NeRFRenderer):
         return torch.cat([feat_xy, feat_yz, feat_xz], dim=-1)
     
 
-    def encode_audio(self, a):
+    def train(self, mode=True):
+        # weights change while training, encoded audio rows go stale
+        if mode:
+            self.aud_tables.clear()
+            self.aud_streams.clear()
+        return super().train(mode)
+
+
+    def encode_audio_rows(self, a):
+        # a: [N, 29, 16] (or [N, 16] if emb) feature rows -> [N, audio_dim]
+        if self.emb:
+            a = self.embedding(a).transpose(-1, -2).contiguous() # [N, 29, 16]
+        return self.audio_net(a)
+
+
+    def audio_table(self, feats, batch_size=1024):
+        # feats: [N, 29, 16] features of a whole clip --> [N + 1, audio_dim] audio_net outputs, encoded once
+        # in batches and kept while feats lives. row N encodes the zero padding of windows at the clip ends.
+        key = id(feats)
+        table = self.aud_tables.get(key)
+        if table is None:
+            device = next(self.audio_net.parameters()).device
+            with torch.no_grad():
+                rows = [self.encode_audio_rows(feats[i:i + batch_size].to(device)) for i in range(0, feats.shape[0], batch_size)]
+                rows.append(self.encode_audio_rows(torch.zeros_like(feats[:1]).to(device)))
+                table = torch.cat(rows, dim=0)
+            self.aud_tables[key] = table
+            weakref.finalize(feats, self.aud_tables.pop, key, None)
+        return table
+
+
+    def audio_rows(self, a, aud_rows):
+        # audio_net outputs of the window a, only encoding the rows not seen before.
+        # aud_rows: (source, index [1/8]) of the window, from collate / get_audio_index or asr.ASR:
+        #   a clip's feature tensor: index into audio_table,
+        #   a live source: absolute row numbers, rows are encoded as they arrive and kept while still in a window.
+        src, index = aud_rows
+        if torch.is_tensor(src):
+            table = self.audio_table(src)
+            return table[index.to(table.device)]
+
+        key = id(src)
+        cache = self.aud_streams.get(key)
+        if cache is None:
+            cache = self.aud_streams[key] = {}
+            weakref.finalize(src, self.aud_streams.pop, key, None)
+        index = index.tolist()
+        new = [k for k, i in enumerate(index) if i not in cache]
+        if new:
+            for k, enc in zip(new, self.encode_audio_rows(a[new])):
+                cache[index[k]] = enc
+            for i in [i for i in cache if i < index[0]]:
+                del cache[i]
+        return torch.stack([cache[i] for i in index], dim=0)
+
+
+    def encode_audio(self, a, aud_rows=None):
         # a: [1, 29, 16] or [8, 29, 16], audio features from deepspeech
         # if emb, a should be: [1, 16] or [8, 16]
+        # aud_rows: optional (source, index) of a, see audio_rows (inference only)
 
         # fix audio traininig
         if a is None: return None
 
-        if self.emb:
-            a = self.embedding(a).transpose(-1, -2).contiguous() # [1/8, 29, 16]
-
-        enc_a = self.audio_net(a) # [8,32]
+        if aud_rows is not None and not self.training:
+            enc_a = self.audio_rows(a, aud_rows) # [8,32], 7 of 8 rows encoded for the previous frame
+        else:
+            enc_a = self.encode_audio_rows(a) # [8,32]
 
         if self.att > 0:
             enc_a = self.audio_att_net(enc_a.unsqueeze(0)) # [1, 32]
@@ -333,9 +396,9 @@ class NeRFNetwork(NeRFRenderer):
     def forward(self, x, d, enc_a, c, e=None):
         # x: [N, 3], in [-bound, bound]
         # d: [N, 3], nomalized in [-1, 1]
-        # enc_a: [1, aud_dim]
+        # enc_a: [1, aud_dim] or [N, aud_dim]
         # c: [1, ind_dim], individual code
-        # e: [1, 1], eye feature
+        # e: [1, 1] or [N, 1], eye feature
         enc_x = self.encode_x(x, bound=self.bound)
 
         sigma_result = self.density(x, enc_a, e, enc_x)
@@ -366,14 +429,17 @@ class NeRFNetwork(NeRFRenderer):
         if enc_x is None:
             enc_x = self.encode_x(x, bound=self.bound)
 
-        enc_a = enc_a.repeat(enc_x.shape[0], 1)
+        # enc_a / e are [1, C] for a single frame, or already [N, C] per sample when frames are batched
+        if enc_a.shape[0] == 1:
+            enc_a = enc_a.repeat(enc_x.shape[0], 1)
         aud_ch_att = self.aud_ch_att_net(enc_x)
         enc_w = enc_a * aud_ch_att
 
         if e is not None:
             # e = self.encoder_eye(e)
             # eye_att = torch.sigmoid(self.eye_att_net(enc_x))
-            e = e.repeat(enc_x.shape[0], 1)
+            if e.shape[0] == 1:
+                e = e.repeat(enc_x.shape[0], 1)
             eye_att = self.eye_att_net(enc_x)
             e = e * eye_att
             # e = e.repeat(enc_x.shape[0], 1)
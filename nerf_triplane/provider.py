@@ -1,17 +1,22 @@
 import os
 import cv2
+import time
 import glob
 import json
 import tqdm
 import numpy as np
 from scipy.spatial.transform import Rotation
-from .network import AudioEncoder
 import trimesh
+from functools import partial
 
 import torch
 from torch.utils.data import DataLoader
 
-from .utils import get_audio_features, get_rays, get_bg_coords, AudDataset
+from .utils import get_audio_index, get_audio_windows, get_rays, get_bg_coords
+from .telemetry import DATASET_LOAD_SECONDS
+# AVE extraction lives in audio_features, re-exported here for existing callers
+from .audio_features import AVE_CKPT_PATH, AudioFeatureExtractor, get_extractor, load_ave_encoder, extract_ave_features
+
 
 # ref: https://github.com/NVlabs/instant-ngp/blob/b76004c8cf478880227401ae763be4c02f80b62f/include/neural-graphics-primitives/nerf_loader.h#L50
 def nerf_matrix_to_ngp(pose, scale=0.33, offset=[0, 0, 0]):
@@ -79,9 +84,48 @@ def visualize_poses(poses, size=0.1):
     trimesh.Scene(objects).show()
 
 
+def prepare_aud_features(opt, aud_features):
+    # numpy features from disk / AVE --> the tensor layout expected by the network.
+    if opt.asr_model == 'ave':
+        aud_features = torch.from_numpy(aud_features).unsqueeze(0)
+
+        # support both [N, 16] labels and [N, 16, K] logits
+        if len(aud_features.shape) == 3:
+            aud_features = aud_features.float().permute(1, 0, 2)  # [N, 16, 29] --> [N, 29, 16]
+
+            if opt.emb:
+                print(f'[INFO] argmax to aud features {aud_features.shape} for --emb mode')
+                aud_features = aud_features.argmax(1)  # [N, 16]
+
+        else:
+            assert opt.emb, "aud only provide labels, must use --emb"
+            aud_features = aud_features.long()
+
+        print(f'[INFO] load {opt.aud} aud_features: {aud_features.shape}')
+    else:
+        aud_features = torch.from_numpy(aud_features)
+
+        # support both [N, 16] labels and [N, 16, K] logits
+        if len(aud_features.shape) == 3:
+            aud_features = aud_features.float().permute(0, 2, 1)  # [N, 16, 29] --> [N, 29, 16]
+
+            if opt.emb:
+                print(f'[INFO] argmax to aud features {aud_features.shape} for --emb mode')
+                aud_features = aud_features.argmax(1)  # [N, 16]
+
+        else:
+            assert opt.emb, "aud only provide labels, must use --emb"
+            aud_features = aud_features.long()
+
+        print(f'[INFO] load {opt.aud} aud_features: {aud_features.shape}')
+
+    return aud_features
+
+
 class NeRFDataset:
-    def __init__(self, opt, device, type='train', downscale=1):
+    def __init__(self, opt, device, type='train', downscale=1, audio_encoder=None):
         super().__init__()
+        t = time.perf_counter()
 
         self.opt = opt
         self.device = device
@@ -157,6 +201,8 @@ class NeRFDataset:
 
         # only load pre-calculated aud features when not live-streaming
         if not self.opt.asr:
+            # the resident AVE extractor, or one around the encoder we were handed
+            ave = get_extractor('ave', device) if audio_encoder is None else AudioFeatureExtractor('ave', model=audio_encoder)
 
             # empty means the default self-driven extracted features.
             if self.opt.aud == '':
@@ -169,22 +215,7 @@ class NeRFDataset:
                 elif 'hubert' in self.opt.asr_model:
                     aud_features = np.load(os.path.join(self.root_path, 'aud_hu.npy'))
                 elif self.opt.asr_model == 'ave':
-                    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-                    model = AudioEncoder().to(device).eval()
-                    ckpt = torch.load('./nerf_triplane/checkpoints/audio_visual_encoder.pth')
-                    model.load_state_dict({f'audio_encoder.{k}': v for k, v in ckpt.items()})
-                    dataset = AudDataset(os.path.join(self.root_path, 'aud.wav'))
-                    data_loader = DataLoader(dataset, batch_size=64, shuffle=False)
-                    outputs = []
-                    for mel in data_loader:
-                        mel = mel.to(device)
-                        with torch.no_grad():
-                            out = model(mel)
-                        outputs.append(out)
-                    outputs = torch.cat(outputs, dim=0).cpu()
-                    first_frame, last_frame = outputs[:1], outputs[-1:]
-                    aud_features = torch.cat([first_frame.repeat(2, 1), outputs, last_frame.repeat(2, 1)],
-                                             dim=0).numpy()
+                    aud_features = ave.extract(os.path.join(self.root_path, 'aud.wav'))
                     # aud_features = np.load(os.path.join(self.root_path, 'aud_ave.npy'))
                 else:
                     aud_features = np.load(os.path.join(self.root_path, 'aud.npy'))
@@ -192,21 +223,7 @@ class NeRFDataset:
             else:
                 if self.opt.asr_model == 'ave':
                     try:
-                        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-                        model = AudioEncoder().to(device).eval()
-                        ckpt = torch.load('./nerf_triplane/checkpoints/audio_visual_encoder.pth')
-                        model.load_state_dict({f'audio_encoder.{k}': v for k, v in ckpt.items()})
-                        dataset = AudDataset(self.opt.aud)
-                        data_loader = DataLoader(dataset, batch_size=64, shuffle=False)
-                        outputs = []
-                        for mel in data_loader:
-                            mel = mel.to(device)
-                            with torch.no_grad():
-                                out = model(mel)
-                            outputs.append(out)
-                        outputs = torch.cat(outputs, dim=0).cpu()
-                        first_frame, last_frame = outputs[:1], outputs[-1:]
-                        aud_features = torch.cat([first_frame.repeat(2, 1), outputs, last_frame.repeat(2, 1)], dim=0).numpy()
+                        aud_features = ave.extract(self.opt.aud)
                     except:
                         print(f'[ERROR] If do not use Audio Visual Encoder, replace it with the npy file path.')
                 else:
@@ -215,38 +232,7 @@ class NeRFDataset:
                     except:
                         print(f'[ERROR] If do not use Audio Visual Encoder, replace it with the npy file path.')
 
-            if self.opt.asr_model == 'ave':
-                aud_features = torch.from_numpy(aud_features).unsqueeze(0)
-
-                # support both [N, 16] labels and [N, 16, K] logits
-                if len(aud_features.shape) == 3:
-                    aud_features = aud_features.float().permute(1, 0, 2)  # [N, 16, 29] --> [N, 29, 16]
-
-                    if self.opt.emb:
-                        print(f'[INFO] argmax to aud features {aud_features.shape} for --emb mode')
-                        aud_features = aud_features.argmax(1)  # [N, 16]
-
-                else:
-                    assert self.opt.emb, "aud only provide labels, must use --emb"
-                    aud_features = aud_features.long()
-
-                print(f'[INFO] load {self.opt.aud} aud_features: {aud_features.shape}')
-            else:
-                aud_features = torch.from_numpy(aud_features)
-
-                # support both [N, 16] labels and [N, 16, K] logits
-                if len(aud_features.shape) == 3:
-                    aud_features = aud_features.float().permute(0, 2, 1)  # [N, 16, 29] --> [N, 29, 16]
-
-                    if self.opt.emb:
-                        print(f'[INFO] argmax to aud features {aud_features.shape} for --emb mode')
-                        aud_features = aud_features.argmax(1)  # [N, 16]
-
-                else:
-                    assert self.opt.emb, "aud only provide labels, must use --emb"
-                    aud_features = aud_features.long()
-
-                print(f'[INFO] load {self.opt.aud} aud_features: {aud_features.shape}')
+            aud_features = prepare_aud_features(self.opt, aud_features)
 
         if self.opt.au45:
             import pandas as pd
@@ -488,6 +474,9 @@ class NeRFDataset:
             if self.opt.exp_eye:
                 self.eye_area = self.eye_area.to(self.device)
 
+        # windowed auds [N, 1/8, ...], on device whatever the preload: collate only indexes it
+        self.aud_windows = get_audio_windows(self.auds.to(self.device), self.opt.att) if self.auds is not None else None
+
         # load intrinsics
         if 'focal_len' in transform:
             fl_x = fl_y = transform['focal_len']
@@ -511,6 +500,8 @@ class NeRFDataset:
         # directly build the coordinate meshgrid in [-1, 1]^2
         self.bg_coords = get_bg_coords(self.H, self.W, self.device) # [1, H*W, 2] in [-1, 1]
 
+        DATASET_LOAD_SECONDS.observe(time.perf_counter() - t)
+
 
     def mirror_index(self, index):
         size = self.poses.shape[0]
@@ -522,17 +513,26 @@ class NeRFDataset:
             return size - res - 1
 
 
-    def collate(self, index):
+    def collate(self, index, auds=None, offset=0, windows=None, first=0):
+        # auds: optional per-loader audio features, overrides self.auds (see dataloader)
+        # offset: frame index of auds[first], so consecutive loaders continue the head pose sequence
+        # windows: get_audio_windows(auds), built with the loader
+        # first: row of auds of the first frame, the rows before it are audio context only
 
         B = len(index) # a list of length 1
         # assert B == 1
 
         results = {}
 
+        if auds is None:
+            auds, windows = self.auds, self.aud_windows
+
         # audio use the original index
-        if self.auds is not None:
-            auds = get_audio_features(self.auds, self.opt.att, index[0]).to(self.device)
-            results['auds'] = auds
+        if auds is not None:
+            # aud_rows: lets the network reuse the audio_net encoding of auds across frames
+            row = index[0] - offset + first
+            results['aud_rows'] = (auds, get_audio_index(auds.shape[0], self.opt.att, row))
+            results['auds'] = windows[row].to(self.device) # [1/8, ...], no-op unless moved (RenderEngine.to)
 
         # head pose and bg image may mirror (replay --> <-- --> <--).
         index[0] = self.mirror_index(index[0])
@@ -652,23 +652,35 @@ class NeRFDataset:
             
         return results
 
-    def dataloader(self):
+    def dataloader(self, auds=None, offset=0, first=0, size=None):
+        # auds: novel audio features (prepare_aud_features layout) for this loader only,
+        #       so several loaders can share one resident dataset without touching self.auds.
+        # offset: start at this frame of the pose sequence (e.g. the frames already rendered for
+        #       earlier sentences of the same utterance), audio still starts at auds[first].
+        # first, size: render the frames of auds[first:first + size] only, the rows around them are
+        #       context of the neighbouring pieces, seen by the attention windows (default: all of auds).
+
+        if auds is not None:
+            auds = auds.to(self.device) if self.preload > 1 else auds
+            windows = get_audio_windows(auds.to(self.device), self.opt.att)
+        else:
+            auds, windows = self.auds, self.aud_windows
 
         if self.training:
             # training len(poses) == len(auds)
             size = self.poses.shape[0]
         else:
             # test with novel auds, then use its length
-            if self.auds is not None:
-                size = self.auds.shape[0]
+            if auds is not None:
+                size = auds.shape[0] - first if size is None else size
             # live stream test, use 2 * len(poses), so it naturally mirrors.
             else:
                 size = 2 * self.poses.shape[0]
 
-        loader = DataLoader(list(range(size)), batch_size=1, collate_fn=self.collate, shuffle=self.training, num_workers=0)
+        loader = DataLoader(list(range(offset, offset + size)), batch_size=1, collate_fn=partial(self.collate, auds=auds, offset=offset, windows=windows, first=first), shuffle=self.training, num_workers=0)
         loader._data = self # an ugly fix... we need poses in trainer.
 
         # do evaluate if has gt images and use self-driven setting
-        loader.has_gt = (self.opt.aud == '')
+        loader.has_gt = (self.opt.aud == '') and auds is self.auds
 
         return loader        
@@ -8,7 +8,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 import raymarching
-from .utils import custom_meshgrid, get_audio_features, euler_angles_to_matrix, convert_poses
+from .utils import custom_meshgrid, get_audio_windows, euler_angles_to_matrix, convert_poses
 
 def sample_pdf(bins, weights, n_samples, det=False):
     # This implementation is from NeRF
@@ -131,6 +131,9 @@ class NeRFRenderer(nn.Module):
         # decay for enc_a
         if self.smooth_lips:
             self.enc_a = None
+
+        # (aud_features, get_audio_windows of it), see audio_window
+        self.aud_windows = None
     
     def forward(self, x, d):
         raise NotImplementedError()
@@ -155,9 +158,10 @@ class NeRFRenderer(nn.Module):
         self.local_step = 0
 
 
-    def run_cuda(self, rays_o, rays_d, auds, bg_coords, poses, eye=None, index=0, dt_gamma=0, bg_color=None, perturb=False, force_all_rays=False, max_steps=1024, T_thresh=1e-4, **kwargs):
+    def run_cuda(self, rays_o, rays_d, auds, bg_coords, poses, eye=None, index=0, dt_gamma=0, bg_color=None, perturb=False, force_all_rays=False, max_steps=1024, T_thresh=1e-4, aud_rows=None, **kwargs):
         # rays_o, rays_d: [B, N, 3], assumes B == 1
         # auds: [B, 16]
+        # aud_rows: optional (source, index) of auds, reuses the audio encoding of earlier frames (see encode_audio)
         # index: [B]
         # return: image: [B, N, 3], depth: [B, N]
 
@@ -185,7 +189,7 @@ class NeRFRenderer(nn.Module):
         fars = fars.detach()
 
         # encode audio
-        enc_a = self.encode_audio(auds) # [1, 32]
+        enc_a = self.encode_audio(auds, aud_rows) # [1, 32]
 
         if enc_a is not None and self.smooth_lips:
             if self.enc_a is not None:
@@ -287,7 +291,111 @@ class NeRFRenderer(nn.Module):
         results['uncertainty'] = uncertainty_sum
 
         return results
-    
+
+
+    def run_cuda_batch(self, frames, dt_gamma=0, perturb=False, max_steps=1024, T_thresh=1e-4, **kwargs):
+        # inference only: march the rays of several frames (e.g. of different concurrent renders) together,
+        # so every network query covers all of them.
+        # frames: list of dict(rays_o, rays_d [1, N, 3], auds, aud_rows or None, bg_coords [1, N, 2], poses, eye [1, 1] or None, index, bg_color)
+        # return: list of dict(image [1, N, 3], depth [1, N]), one per frame
+        # note: smooth_lips is not applied, its state is per-sequence.
+
+        all_rays_o, all_rays_d, enc_as, eyes, counts = [], [], [], [], []
+        for f in frames:
+            rays_o = f['rays_o'].contiguous().view(-1, 3)
+            rays_d = f['rays_d'].contiguous().view(-1, 3)
+
+            if self.train_camera and self.test_train:
+                index = f['index']
+                dT = self.camera_dT[index] # [1, 3]
+                dR = euler_angles_to_matrix(self.camera_dR[index] / 180 * np.pi + 1e-8).squeeze(0) # [1, 3] --> [3, 3]
+                rays_o = rays_o + dT
+                rays_d = rays_d @ dR
+
+            all_rays_o.append(rays_o)
+            all_rays_d.append(rays_d)
+            enc_as.append(self.encode_audio(f['auds'], f.get('aud_rows'))) # [1, 32]
+            eyes.append(f['eye'])
+            counts.append(rays_o.shape[0])
+
+        rays_o = torch.cat(all_rays_o, dim=0)
+        rays_d = torch.cat(all_rays_d, dim=0)
+
+        N = rays_o.shape[0] # rays of all frames
+        device = rays_o.device
+
+        # frame id of every ray, to pick the audio / eye code of every sample
+        ray_frame = torch.repeat_interleave(torch.arange(len(frames), device=device), torch.tensor(counts, device=device))
+        enc_a = torch.cat(enc_as, dim=0) # [F, 32]
+        eye = torch.cat(eyes, dim=0) if eyes[0] is not None else None # [F, 1]
+
+        # use a fixed ind code for the unknown test data.
+        ind_code = self.individual_codes[0] if self.individual_dim > 0 else None
+
+        nears, fars = raymarching.near_far_from_aabb(rays_o, rays_d, self.aabb_infer, self.min_near)
+        nears = nears.detach()
+        fars = fars.detach()
+
+        dtype = torch.float32
+
+        weights_sum = torch.zeros(N, dtype=dtype, device=device)
+        depth = torch.zeros(N, dtype=dtype, device=device)
+        image = torch.zeros(N, 3, dtype=dtype, device=device)
+        amb_aud_sum = torch.zeros(N, dtype=dtype, device=device)
+        amb_eye_sum = torch.zeros(N, dtype=dtype, device=device)
+        uncertainty_sum = torch.zeros(N, dtype=dtype, device=device)
+
+        n_alive = N
+        rays_alive = torch.arange(n_alive, dtype=torch.int32, device=device) # [N]
+        rays_t = nears.clone() # [N]
+
+        step = 0
+
+        while step < max_steps:
+
+            n_alive = rays_alive.shape[0]
+            if n_alive <= 0:
+                break
+
+            n_step = max(min(N // n_alive, 8), 1)
+
+            xyzs, dirs, deltas = raymarching.march_rays(n_alive, n_step, rays_alive, rays_t, rays_o, rays_d, self.bound, self.density_bitfield, self.cascade, self.grid_size, nears, fars, 128, perturb if step == 0 else False, dt_gamma, max_steps)
+
+            # samples are laid out as [n_alive, n_step]
+            pts_frame = ray_frame[rays_alive.long()].repeat_interleave(n_step)
+            pts_eye = eye[pts_frame] if eye is not None else None
+
+            sigmas, rgbs, ambients_aud, ambients_eye, uncertainties = self(xyzs, dirs, enc_a[pts_frame], ind_code, pts_eye)
+            sigmas = self.density_scale * sigmas
+
+            raymarching.composite_rays_triplane(n_alive, n_step, rays_alive, rays_t, sigmas, rgbs, deltas, ambients_aud, ambients_eye, uncertainties, weights_sum, depth, image, amb_aud_sum, amb_eye_sum, uncertainty_sum, T_thresh)
+
+            rays_alive = rays_alive[rays_alive >= 0]
+
+            step += n_step
+
+        depth = torch.clamp(depth - nears, min=0) / (fars - nears)
+
+        # torso and background are 2D and depend on the pose, done per frame
+        results = []
+        start = 0
+        for f, f_rays_o, n in zip(frames, all_rays_o, counts):
+            prefix = f['rays_o'].shape[:-1]
+            rays = slice(start, start + n)
+            start += n
+
+            torso_results = self.run_torso(f_rays_o, f['bg_coords'], f['poses'], f['index'], f['bg_color'])
+            bg_color = torso_results['bg_color']
+            f_image = image[rays] + (1 - weights_sum[rays]).unsqueeze(-1) * bg_color
+            f_image = f_image.view(*prefix, 3).clamp(0, 1)
+
+            results.append({
+                'image': f_image,
+                'depth': depth[rays].view(*prefix),
+            })
+
+        return results
+
 
     def run_torso(self, rays_o, bg_coords, poses, index=0, bg_color=None, **kwargs):
         # rays_o, rays_d: [B, N, 3], assumes B == 1
@@ -415,6 +523,12 @@ class NeRFRenderer(nn.Module):
 
         #print(f'[mark untrained grid] {(count == 0).sum()} from {resolution ** 3 * self.cascade}')
 
+    def audio_window(self, index):
+        # window of aud_features at index, from a windowed view rebuilt whenever aud_features is reassigned
+        if self.aud_windows is None or self.aud_windows[0] is not self.aud_features:
+            self.aud_windows = (self.aud_features, get_audio_windows(self.aud_features.to(self.density_bitfield.device), self.att))
+        return self.aud_windows[1][index]
+
     @torch.no_grad()
     def update_extra_state(self, decay=0.95, S=128):
         # call before each epoch to update extra states.
@@ -424,7 +538,7 @@ class NeRFRenderer(nn.Module):
         
         # use random auds (different expressions should have similar density grid...)
         rand_idx = random.randint(0, self.aud_features.shape[0] - 1)
-        auds = get_audio_features(self.aud_features, self.att, rand_idx).to(self.density_bitfield.device)
+        auds = self.audio_window(rand_idx)
 
         # encode audio
         enc_a = self.encode_audio(auds)
@@ -546,7 +660,7 @@ class NeRFRenderer(nn.Module):
         
         # use random auds (different expressions should have similar density grid...)
         rand_idx = random.randint(0, self.aud_features.shape[0] - 1)
-        auds = get_audio_features(self.aud_features, self.att, rand_idx).to(self.density_bitfield.device)
+        auds = self.audio_window(rand_idx)
 
         # encode audio
         enc_a = self.encode_audio(auds)
@@ -603,7 +717,7 @@ class NeRFRenderer(nn.Module):
         
         # use random auds (different expressions should have similar density grid...)
         rand_idx = random.randint(0, self.aud_features.shape[0] - 1)
-        auds = get_audio_features(self.aud_features, self.att, rand_idx).to(self.density_bitfield.device)
+        auds = self.audio_window(rand_idx)
 
         # encode audio
         enc_a = self.encode_audio(auds)
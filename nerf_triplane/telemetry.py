@@ -0,0 +1,156 @@
+# telemetry.py
+"""
+Minimal Prometheus-style metrics, stdlib only (safe to import from the web apps).
+
+Stage timings are histograms observed directly in the functions doing the work
+(TTS, AVE features, dataset load, test_step, video encode, ffmpeg mux), the
+apps register gauges (and counters they already keep, e.g. JobManager.rejected)
+read at scrape time and serve `REGISTRY.expose()` on
+/metrics in the text exposition format.
+
+    with TTS_SECONDS.time(engine="gtts"):
+        ...
+    REGISTRY.gauge("synctalk_queue_depth", "jobs waiting", fn=lambda: JOBS.queued)
+    REGISTRY.counter("synctalk_jobs_rejected_total", "jobs refused", fn=lambda: JOBS.rejected)
+"""
+import math, threading, time
+from contextlib import contextmanager
+
+# seconds, from a single frame (~10 ms) to a long clip (~10 min)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class _Value:
+    # a number per label set, set / incremented by the app or read from fn at scrape time
+
+    def __init__(self, name, help, fn=None, label="name"):
+        # fn: optional callable read at scrape time, returning a number or {label value: number}
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                return []
+            if isinstance(value, dict):
+                return [(self.name, {self.label: k}, v) for k, v in value.items()]
+            return [(self.name, {}, value)]
+        with self.lock:
+            return [(self.name, dict(k), v) for k, v in self.values.items()]
+
+
+class Counter(_Value):
+    # monotonic: a fn must return a count that only grows (since process start), named *_total
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Value):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {} # labels -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, n = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, (counts, total, n) in self.values.items():
+                labels = dict(key)
+                for b, c in zip(self.buckets, counts):
+                    out.append((f"{self.name}_bucket", {**labels, "le": "+Inf" if b == math.inf else repr(b)}, c))
+                out.append((f"{self.name}_sum", labels, total))
+                out.append((f"{self.name}_count", labels, n))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            # re-registering (e.g. a module reloaded) returns the existing metric
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, fn=None, label="name"):
+        counter = self._add(Counter(name, help, fn, label))
+        counter.fn = fn or counter.fn # the latest callback wins
+        return counter
+
+    def gauge(self, name, help, fn=None, label="name"):
+        gauge = self._add(Gauge(name, help, fn, label))
+        gauge.fn = fn or gauge.fn # the latest callback wins
+        return gauge
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def expose(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{_labels(labels)} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- per-stage timings, observed where the work happens ---
+TTS_SECONDS = REGISTRY.histogram("synctalk_tts_seconds", "text to speech synthesis per call (tts.py backends)")
+AVE_SECONDS = REGISTRY.histogram("synctalk_ave_features_seconds", "AVE feature extraction per wav (AudDataset mel + AudioEncoder)")
+ASR_STEP_SECONDS = REGISTRY.histogram("synctalk_asr_step_seconds", "wav2vec forward per ASR context window (asr.ASR.run_step)")
+DATASET_LOAD_SECONDS = REGISTRY.histogram("synctalk_dataset_load_seconds", "NeRFDataset construction")
+FRAME_SECONDS = REGISTRY.histogram("synctalk_frame_render_seconds", "network render time per frame (Trainer.test_step)")
+ENCODE_SECONDS = REGISTRY.histogram("synctalk_video_encode_seconds", "video encode per clip (imageio or streaming ffmpeg)")
+MUX_SECONDS = REGISTRY.histogram("synctalk_mux_seconds", "ffmpeg audio mux per clip")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("synctalk_queue_wait_seconds", "time jobs spent queued before a render slot took them")
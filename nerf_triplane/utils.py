@@ -26,6 +26,8 @@ from packaging import version as pver
 import imageio
 import lpips
 
+from .telemetry import FRAME_SECONDS, ENCODE_SECONDS, MUX_SECONDS
+
 def custom_meshgrid(*args):
     # ref: https://pytorch.org/docs/stable/generated/torch.meshgrid.html?highlight=meshgrid#torch.meshgrid
     if pver.parse(torch.__version__) < pver.parse('1.10'):
@@ -80,6 +82,35 @@ def get_audio_features(features, att_mode, index):
         raise NotImplementedError(f'wrong att_mode: {att_mode}')
 
 
+def get_audio_windows(features, att_mode):
+    # [N, ...] features --> [N, 1/8, ...]: the get_audio_features window of every index, built once.
+    # a strided view over one zero-padded copy of features, so a frame's window is just windows[index].
+    if att_mode == 0:
+        return features.unsqueeze(1)
+    elif att_mode == 1:
+        pad_left, pad_right = 8, 0 # [index - 8, index)
+    elif att_mode == 2:
+        pad_left, pad_right = 4, 4 # [index - 4, index + 4)
+    else:
+        raise NotImplementedError(f'wrong att_mode: {att_mode}')
+    N = features.shape[0]
+    padded = torch.cat([features.new_zeros(pad_left, *features.shape[1:]), features, features.new_zeros(pad_right, *features.shape[1:])], dim=0)
+    return padded.as_strided((N, 8, *padded.shape[1:]), (padded.stride(0), *padded.stride()))
+
+
+def get_audio_index(length, att_mode, index):
+    # feature rows of the get_audio_features window at index, padding rows as `length` (see NeRFNetwork.audio_table)
+    if att_mode == 0:
+        rows = torch.arange(index, index + 1)
+    elif att_mode == 1:
+        rows = torch.arange(index - 8, index)
+    elif att_mode == 2:
+        rows = torch.arange(index - 4, index + 4)
+    else:
+        raise NotImplementedError(f'wrong att_mode: {att_mode}')
+    return torch.where((rows < 0) | (rows >= length), torch.full_like(rows, length), rows)
+
+
 @torch.jit.script
 def linear_to_srgb(x):
     return torch.where(x < 0.0031308, 12.92 * x, 1.055 * x ** 0.41666 - 0.055)
@@ -656,6 +687,7 @@ class Trainer(object):
         self.max_keep_ckpt = max_keep_ckpt
         self.eval_interval = eval_interval
         self.use_checkpoint = use_checkpoint
+        self.checkpoint = None # path of the loaded checkpoint, if any
         self.use_tensorboardX = use_tensorboardX
         self.flip_finetune_lips = self.opt.finetune_lips
         self.flip_init_lips = self.opt.init_lips
@@ -941,7 +973,7 @@ class Trainer(object):
         # bg_color = 1
         bg_color = data['bg_color']
 
-        outputs = self.model.render(rays_o, rays_d, auds, bg_coords, poses, eye=eye, index=index, staged=True, bg_color=bg_color, perturb=False, **vars(self.opt))
+        outputs = self.model.render(rays_o, rays_d, auds, bg_coords, poses, eye=eye, index=index, staged=True, bg_color=bg_color, perturb=False, aud_rows=data.get('aud_rows'), **vars(self.opt))
 
         pred_rgb = outputs['image'].reshape(B, H, W, 3)
         pred_depth = outputs['depth'].reshape(B, H, W)
@@ -956,6 +988,7 @@ class Trainer(object):
 
     # moved out bg_color and perturb for more flexible control...
     def test_step(self, data, bg_color=None, perturb=False):  
+        t = time.perf_counter()
 
         rays_o = data['rays_o'] # [B, N, 3]
         rays_d = data['rays_d'] # [B, N, 3]
@@ -977,16 +1010,65 @@ class Trainer(object):
         else:
             bg_color = data['bg_color']
 
-        self.model.testing = True
-        outputs = self.model.render(rays_o, rays_d, auds, bg_coords, poses, eye=eye, index=index, staged=True, bg_color=bg_color, perturb=perturb, **vars(self.opt))
-        self.model.testing = False
+        # restored, not reset: a render engine sets it once for all its (concurrent) renders
+        testing, self.model.testing = self.model.testing, True
+        outputs = self.model.render(rays_o, rays_d, auds, bg_coords, poses, eye=eye, index=index, staged=True, bg_color=bg_color, perturb=perturb, aud_rows=data.get('aud_rows'), **vars(self.opt))
+        self.model.testing = testing
 
         pred_rgb = outputs['image'].reshape(-1, H, W, 3)
         pred_depth = outputs['depth'].reshape(-1, H, W)
 
+        if torch.cuda.is_available():
+            torch.cuda.synchronize() # kernels are async, time the actual work
+        FRAME_SECONDS.observe(time.perf_counter() - t, batched="0")
+
         return pred_rgb, pred_depth
 
 
+    def test_step_batch(self, datas, bg_color=None, perturb=False):
+        # same as test_step for a list of single-frame batches (possibly from different loaders),
+        # rendered in one pass. returns a list of (pred_rgb, pred_depth).
+        t = time.perf_counter()
+
+        frames = []
+        for data in datas:
+            # allow using a fixed eye area (avoid eye blink) at test
+            if self.opt.exp_eye and self.opt.fix_eye >= 0:
+                eye = torch.FloatTensor([self.opt.fix_eye]).view(1, 1).to(self.device)
+            else:
+                eye = data['eye'] # [1, 1]
+
+            frames.append({
+                'rays_o': data['rays_o'], # [1, N, 3]
+                'rays_d': data['rays_d'], # [1, N, 3]
+                'auds': data['auds'],
+                'aud_rows': data.get('aud_rows'),
+                'bg_coords': data['bg_coords'], # [1, N, 2]
+                'poses': data['poses'],
+                'eye': eye,
+                'index': data['index'],
+                'bg_color': bg_color.to(self.device) if bg_color is not None else data['bg_color'],
+            })
+
+        testing, self.model.testing = self.model.testing, True
+        outputs = self.model.run_cuda_batch(frames, perturb=perturb, **vars(self.opt))
+        self.model.testing = testing
+
+        preds = []
+        for data, outputs_i in zip(datas, outputs):
+            H, W = data['H'], data['W']
+            preds.append((outputs_i['image'].reshape(-1, H, W, 3), outputs_i['depth'].reshape(-1, H, W)))
+
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        # per frame, comparable with test_step
+        per_frame = (time.perf_counter() - t) / len(datas)
+        for _ in datas:
+            FRAME_SECONDS.observe(per_frame, batched="1")
+
+        return preds
+
+
     def save_mesh(self, save_path=None, resolution=256, threshold=10):
 
         if save_path is None:
@@ -1041,7 +1123,18 @@ class Trainer(object):
 
     # Function to blend two images with a mask
 
-    def test(self, loader, save_path=None, name=None, write_image=False):
+    def test(self, loader, save_path=None, name=None, write_image=False, progress=None, aud=None, step=None, writer=None):
+        # progress: optional callable(frames_done, frames_total), e.g. to report job status from a server.
+        # aud: wav to mux into {name}_audio.mp4, defaults to opt.aud (pass it explicitly when rendering concurrently).
+        # step: optional replacement for self.test_step, callable(data) -> (preds, preds_depth), e.g. a frame batcher.
+        # writer: optional streaming encoder (video_stream.StreamWriter), gets every frame as soon as it is
+        #         rendered instead of collecting them for imageio + ffmpeg at the end. The caller owns audio and close().
+
+        if step is None:
+            step = self.test_step
+
+        if aud is None:
+            aud = self.opt.aud
 
         if save_path is None:
             save_path = os.path.join(self.workspace, 'results')
@@ -1064,7 +1157,7 @@ class Trainer(object):
             for i, data in enumerate(loader):
                 
                 with torch.cuda.amp.autocast(enabled=self.fp16):
-                    preds, preds_depth = self.test_step(data)                
+                    preds, preds_depth = step(data)
                 
                 path = os.path.join(save_path, f'{name}_{i:04d}_rgb.png')
                 path_depth = os.path.join(save_path, f'{name}_{i:04d}_depth.png')
@@ -1087,18 +1180,29 @@ class Trainer(object):
                     imageio.imwrite(path, pred)
                     imageio.imwrite(path_depth, pred_depth)
 
-                all_preds.append(pred)
-                all_preds_depth.append(pred_depth)
+                if writer is not None:
+                    writer.write_frame(pred)
+                else:
+                    all_preds.append(pred)
+                    all_preds_depth.append(pred_depth)
 
                 pbar.update(loader.batch_size)
+                if progress is not None:
+                    progress(pbar.n, pbar.total)
+
+        if writer is not None:
+            self.log(f"==> Finished Test.")
+            return
 
         # write video
         all_preds = np.stack(all_preds, axis=0)
         all_preds_depth = np.stack(all_preds_depth, axis=0)
-        imageio.mimwrite(os.path.join(save_path, f'{name}.mp4'), all_preds, fps=25, quality=8, macro_block_size=1)
+        with ENCODE_SECONDS.time(streaming="0"):
+            imageio.mimwrite(os.path.join(save_path, f'{name}.mp4'), all_preds, fps=25, quality=8, macro_block_size=1)
         imageio.mimwrite(os.path.join(save_path, f'{name}_depth.mp4'), all_preds_depth, fps=25, quality=8, macro_block_size=1)
-        if self.opt.aud != '' and self.opt.asr_model == 'ave':
-            os.system(f'ffmpeg -i {os.path.join(save_path, f"{name}.mp4")} -i {self.opt.aud} -strict -2 -c:v copy {os.path.join(save_path, f"{name}_audio.mp4")} -y')
+        if aud != '' and self.opt.asr_model == 'ave':
+            with MUX_SECONDS.time():
+                os.system(f'ffmpeg -i "{os.path.join(save_path, f"{name}.mp4")}" -i "{aud}" -strict -2 -c:v copy "{os.path.join(save_path, f"{name}_audio.mp4")}" -y')
 
         self.log(f"==> Finished Test.")
     
@@ -1164,8 +1268,9 @@ class Trainer(object):
         return outputs
     
     # [GUI] test on a single image
-    def test_gui(self, pose, intrinsics, W, H, auds, eye=None, index=0, bg_color=None, spp=1, downscale=1):
-        
+    def test_gui(self, pose, intrinsics, W, H, auds, eye=None, index=0, bg_color=None, spp=1, downscale=1, aud_rows=None):
+        # aud_rows: optional (source, index) of auds, see NeRFNetwork.encode_audio
+
         # render resolution (may need downscale to for better frame rate)
         rH = int(H * downscale)
         rW = int(W * downscale)
@@ -1188,6 +1293,7 @@ class Trainer(object):
             'H': rH,
             'W': rW,
             'auds': auds,
+            'aud_rows': aud_rows,
             'index': [index], # support choosing index for individual codes
             'eye': eye,
             'poses': pose,
@@ -1523,6 +1629,7 @@ class Trainer(object):
                 return
 
         checkpoint_dict = torch.load(checkpoint, map_location=self.device)
+        self.checkpoint = checkpoint
         
         if 'model' not in checkpoint_dict:
             self.model.load_state_dict(checkpoint_dict)
@@ -1617,9 +1724,13 @@ def _normalize(S):
 
 class AudDataset(object):
     def __init__(self, wavpath):
-        wav = load_wav(wavpath, 16000)
+        # wavpath: path of a wav file, or mono float PCM already at 16 kHz (e.g. from tts.py)
+        if isinstance(wavpath, np.ndarray):
+            wav = wavpath.astype(np.float32)
+        else:
+            wav = load_wav(wavpath, 16000)
 
-        self.orig_mel = melspectrogram(wav).T
+        self.orig_mel = np.ascontiguousarray(melspectrogram(wav).T, dtype=np.float32) # [T, 80]
         self.data_len = int((self.orig_mel.shape[0] - 16) / 80. * float(25)) + 2
 
     def get_frame_id(self, frame):
@@ -1640,14 +1751,101 @@ class AudDataset(object):
 
         return spec[start_idx: end_idx, :]
 
+    def window_starts(self):
+        # first mel step of every frame's window: same rounding and end clamping as crop_audio_window
+        starts = (80. * (np.arange(self.data_len) / float(25))).astype(np.int64)
+        return np.minimum(starts, self.orig_mel.shape[0] - 16)
+
+    def batches(self, batch_size=64, device=None):
+        # all windows without a DataLoader: yields [B, 1, 80, 16], the same as collating __getitem__.
+        # the mel goes to the device once, unfold is a strided view of it, only the gather copies.
+        if self.orig_mel.shape[0] < 16:
+            raise Exception('mel.shape[0] != 16')
+        mel = torch.from_numpy(self.orig_mel).to(device)
+        windows = mel.unfold(0, 16, 1) # [T - 15, 80, 16], windows[k] == mel[k:k + 16].T
+        starts = torch.from_numpy(self.window_starts()).to(mel.device)
+        for i in range(0, self.data_len, batch_size):
+            yield windows[starts[i:i + batch_size]].unsqueeze(1)
+
     def __len__(self):
         return self.data_len
 
     def __getitem__(self, idx):
 
-        mel = self.crop_audio_window(self.orig_mel.copy(), idx)
+        mel = self.crop_audio_window(self.orig_mel, idx)
         if (mel.shape[0] != 16):
             raise Exception('mel.shape[0] != 16')
         mel = torch.FloatTensor(mel.T).unsqueeze(0)
 
         return mel
+
+
+class StreamingMel(object):
+    # melspectrogram of a live PCM stream for the AVE encoder: the same steps as melspectrogram on the whole wav
+    # (preemphasis, centered stft n_fft=800 hop=200, 80 mels, db, normalize), but push() only computes the stft
+    # frames its samples complete, keeping the last n_fft - hop samples as overlap. returns the AudDataset windows
+    # ([80, 16], one per 25 fps video frame) as soon as their 16 mel steps exist.
+    #   mel = StreamingMel()
+    #   for chunk in chunks: # 16 kHz float PCM, e.g. 20 ms = 320 samples
+    #       windows = mel.push(chunk)
+    #   windows = mel.flush() # end of stream: zero pads like the offline stft, the last windows are end-clamped
+    n_fft = 800
+    hop = 200
+
+    def __init__(self):
+        self.window = signal.get_window('hann', self.n_fft, fftbins=True)
+        self.mel_basis = _build_mel_basis() # [80, 401]
+        self.last = 0. # last sample, preemphasis carries over chunks
+        self.samples = np.zeros(self.n_fft // 2, dtype=np.float32) # not yet framed, starts with the centering pad
+        self.mel = np.zeros((0, 80), dtype=np.float32) # mel steps still needed, from step mel_start on
+        self.mel_start = 0
+        self.steps = 0 # mel steps so far
+        self.frame = 0 # next video frame
+
+    def push(self, pcm):
+        pcm = np.asarray(pcm, dtype=np.float32)
+        if len(pcm) == 0:
+            return []
+        emph = pcm - 0.97 * np.concatenate([[self.last], pcm[:-1]])
+        self.last = pcm[-1]
+        self._stft(emph.astype(np.float32))
+        return self._windows()
+
+    def flush(self):
+        self._stft(np.zeros(self.n_fft // 2, dtype=np.float32))
+        if self.steps < 16:
+            return []
+        return self._windows(data_len=int((self.steps - 16) / 80. * float(25)) + 2)
+
+    def _stft(self, samples):
+        buf = np.concatenate([self.samples, samples])
+        n = (len(buf) - self.n_fft) // self.hop + 1 if len(buf) >= self.n_fft else 0
+        if n > 0:
+            frames = np.lib.stride_tricks.sliding_window_view(buf, self.n_fft)[::self.hop][:n] # [n, 800]
+            S = np.abs(np.fft.rfft(frames * self.window, axis=1)) # [n, 401]
+            S = _amp_to_db(S @ self.mel_basis.T) - 20
+            self.mel = np.concatenate([self.mel, _normalize(S).astype(np.float32)], axis=0)
+            self.steps += n
+        self.samples = buf[n * self.hop:]
+
+    def _windows(self, data_len=None):
+        # data_len: end of stream, emit up to that frame with crop_audio_window's end clamping
+        windows = []
+        while True:
+            start = int(80. * (self.frame / float(25)))
+            if data_len is None:
+                if start + 16 > self.steps:
+                    break
+            else:
+                if self.frame >= data_len:
+                    break
+                start = min(start, self.steps - 16)
+            windows.append(self.mel[start - self.mel_start:start - self.mel_start + 16].T)
+            self.frame += 1
+
+        # drop the steps no later window uses (the last 16 stay for the end clamping)
+        drop = min(int(80. * (self.frame / float(25))), self.steps - 16) - self.mel_start
+        if drop > 0:
+            self.mel = self.mel[drop:]
+            self.mel_start += drop
+        return windows
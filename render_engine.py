@@ -0,0 +1,326 @@
+# render_engine.py
+"""
+Long-lived, in-process talking face renderer.
+
+Loads the avatar once (NeRFNetwork + checkpoint, the train dataset used by
+--test_train, and the Audio Visual Encoder) and then renders any number of WAVs,
+instead of spawning `main.py ... --test --test_train --aud x.wav` per request.
+
+    engine = RenderEngine("data/May", "model/trial_may")
+    mp4 = engine.render("demo/test.wav", save_path="results/jobs/<id>", name="render")
+    # -> results/jobs/<id>/render_audio.mp4
+
+Renders do not share any per-request state (each gets its own loader, audio
+features and output paths), so up to `max_concurrent` of them can run at once.
+With `batch_frames > 1` their frames are rendered together by a FrameBatcher.
+"""
+import os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue, Empty
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+
+
+class _Frame:
+    def __init__(self, data):
+        self.data = data
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FrameBatcher:
+    """Runs the frames of concurrent renders through the network together.
+
+    Every render calls `step(data)` instead of Trainer.test_step. A single thread
+    collects pending frames for at most `max_wait_ms` (or until every active
+    render has one queued) and renders up to `max_batch` of them in one pass with
+    Trainer.test_step_batch, then hands each result back to its caller.
+    """
+
+    def __init__(self, trainer, max_batch=4, max_wait_ms=10):
+        self.trainer = trainer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = Queue()
+        self.active = 0 # renders currently feeding frames
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.frames = 0
+
+        threading.Thread(target=self._loop, name="frame-batcher", daemon=True).start()
+
+    @contextmanager
+    def session(self):
+        # wrap a render, so the batcher knows how many frames it can expect at most
+        with self.lock:
+            self.active += 1
+        try:
+            yield self.step
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def step(self, data):
+        # drop-in for Trainer.test_step, blocks until the batch holding this frame is rendered
+        frame = _Frame(data)
+        self.queue.put(frame)
+        frame.done.wait()
+        if frame.error is not None:
+            raise frame.error
+        return frame.result
+
+    def close(self):
+        # ends the batching thread once pending frames are done
+        self.queue.put(None)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "frames": self.frames,
+            "mean_batch": self.frames / self.batches if self.batches else 0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def _loop(self):
+        import torch
+
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            batch = [frame]
+            deadline = time.time() + self.max_wait
+            # each render has at most one frame in flight, never wait for more than that
+            while len(batch) < min(self.max_batch, max(self.active, 1)):
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    frame = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if frame is None:
+                    self.queue.put(None) # stop after this batch
+                    break
+                batch.append(frame)
+
+            try:
+                # no_grad / autocast are per thread, set them up here as Trainer.test does
+                with torch.no_grad(), torch.cuda.amp.autocast(enabled=self.trainer.fp16):
+                    results = self.trainer.test_step_batch([f.data for f in batch])
+                for f, result in zip(batch, results):
+                    f.result = result
+                self.batches += 1
+                self.frames += len(batch)
+            except Exception as e:
+                for f in batch:
+                    f.error = e
+            finally:
+                for f in batch:
+                    f.done.set()
+
+
+class RenderEngine:
+    def __init__(self, data_root, workspace, portrait=True, extra_args=None, max_concurrent=1, batch_frames=1, batch_wait_ms=10,
+                 audio_encoder=None, device=None):
+        # audio_encoder: an already loaded AVE encoder to use, default the resident one of the device
+        #   (audio_features.get_extractor, shared by every engine: it does not depend on the avatar)
+        # device: default cuda when available
+        # heavy imports live here, so the web apps can import this module without pulling in torch.
+        import torch
+        from main import get_opt
+        from nerf_triplane.network import NeRFNetwork
+        from nerf_triplane.audio_features import AudioFeatureExtractor, get_extractor
+        from nerf_triplane.provider import NeRFDataset
+        from nerf_triplane.utils import Trainer, seed_everything
+
+        t = time.time()
+
+        # same flags the servers used to pass to main.py
+        args = [str(data_root), "--workspace", str(workspace), "-O", "--test", "--test_train", "--asr_model", "ave"]
+        if portrait:
+            args.append("--portrait")
+        args.extend(extra_args or [])
+        self.args = args
+        self.opt = get_opt(args)
+
+        seed_everything(self.opt.seed)
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+
+        if audio_encoder is not None:
+            self.features = AudioFeatureExtractor("ave", self.device, model=audio_encoder)
+        else:
+            self.features = get_extractor("ave", self.device)
+        self.audio_encoder = self.features.model
+
+        self.model = NeRFNetwork(self.opt)
+        criterion = torch.nn.L1Loss(reduction="none")
+        # no metrics: we never evaluate, so LMD (face_alignment) is not needed.
+        self.trainer = Trainer("ngp", self.opt, self.model, device=self.device, workspace=self.opt.workspace,
+                               criterion=criterion, fp16=self.opt.fp16, metrics=[], use_checkpoint=self.opt.ckpt)
+
+        # a manual fix to test on the training dataset (same as main.py --test_train)
+        self.dataset = NeRFDataset(self.opt, device=self.device, type="train", audio_encoder=self.audio_encoder)
+        self.dataset.training = False
+        self.dataset.num_rays = -1
+
+        # temp fix: for update_extra_states
+        self.model.aud_features = self.dataset.auds
+        self.model.eye_areas = self.dataset.eye_area
+
+        # concurrent renders share the dataset and model: per-render audio lives in the loaders, and the
+        # testing flag is set once here instead of per frame. --smooth_lips keeps the previous frame's
+        # audio code in the model (NeRFRenderer.enc_a), such engines render one sequence at a time.
+        self.model.testing = True
+        if self.opt.smooth_lips and max_concurrent > 1:
+            print(f"[WARN] --smooth_lips keeps per-sequence state in the model, rendering one at a time instead of {max_concurrent}")
+            max_concurrent = 1
+        self.slots = threading.Semaphore(max_concurrent)
+
+        # batch_frames > 1: concurrent renders share network passes, each frame waits at most batch_wait_ms for company
+        self.batcher = FrameBatcher(self.trainer, batch_frames, batch_wait_ms) if batch_frames > 1 and max_concurrent > 1 else None
+
+        print(f"[INFO] render engine ready in {time.time() - t:.2f}s ({self.opt.workspace})")
+
+    def close(self):
+        # stop the background threads, the rest is freed with the last reference
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def render(self, wav_path, save_path=None, name=None, progress=None, frame_offset=0, num_frames=None, mux=True, pcm=None, writer=None,
+               context=(0, 0)):
+        """Render a talking face for `wav_path`, returns the path of the muxed mp4.
+
+        save_path, name: output goes to {save_path}/{name}.mp4 and {name}_audio.mp4,
+            give every concurrent render its own save_path.
+        progress: optional callable(frames_done, frames_total), called after every frame.
+        frame_offset, num_frames: render a piece of a longer utterance, starting at this frame
+            of the head pose sequence and cut / padded to exactly num_frames (25 fps).
+        mux: False skips muxing the audio and returns the silent {name}.mp4.
+        pcm: optional 16 kHz mono float samples of wav_path (e.g. from tts.py), features are then
+            computed from memory and wav_path is only read by ffmpeg for muxing (may be None with a writer).
+        writer: optional video_stream.StreamWriter, frames are streamed into it as they are rendered
+            (the caller writes the audio and closes it), returns None.
+        context: (before, after) frames of pcm (640 samples each) that belong to the previous / next
+            piece of the utterance. They only feed the AVE features and attention windows, so the lips
+            move across piece boundaries as in one render of the whole utterance; num_frames is required.
+            pcm should start at a multiple of 5 frames (16 mel steps) of the utterance, for the mel windows
+            to line up with the ones of a single pass.
+        """
+        import torch
+        from nerf_triplane.provider import prepare_aud_features
+
+        wav_path = str(wav_path) if wav_path is not None else None
+        if save_path is None:
+            save_path = os.path.join(self.trainer.workspace, "results")
+        if name is None:
+            name = f"{self.trainer.name}_ep{self.trainer.epoch:04d}"
+
+        with self.slots:
+            t = time.time()
+            if self.opt.smooth_lips:
+                self.model.enc_a = None  # the decay starts over, not from the last frame of another render
+            auds = prepare_aud_features(self.opt, self.features.extract(wav_path if pcm is None else pcm))
+            before, after = context
+            assert num_frames is not None or context == (0, 0), "an audio context needs num_frames"
+            if num_frames is not None:
+                # AVE yields ~1 frame more than the audio lasts, pieces must not drift when concatenated
+                length = before + num_frames + after
+                auds = auds[:length]
+                if auds.shape[0] < length:
+                    auds = torch.cat([auds, auds[-1:].repeat(length - auds.shape[0], *[1] * (auds.dim() - 1))], dim=0)
+            loader = self.dataset.dataloader(auds=auds, offset=frame_offset, first=before, size=num_frames)
+            aud = wav_path if mux and writer is None else ''
+            if self.batcher is not None:
+                with self.batcher.session() as step:
+                    self.trainer.test(loader, save_path=save_path, name=name, progress=progress, aud=aud, step=step, writer=writer)
+            else:
+                self.trainer.test(loader, save_path=save_path, name=name, progress=progress, aud=aud, writer=writer)
+            print(f"[INFO] rendered {wav_path or 'pcm'} ({len(loader)} frames) in {time.time() - t:.2f}s")
+
+        if writer is not None:
+            return None
+
+        out_path = os.path.join(save_path, f"{name}_audio.mp4" if mux else f"{name}.mp4")
+        if not os.path.exists(out_path):
+            raise RuntimeError(f"render produced no video: {out_path}")
+        return out_path
+
+
+class MockRenderEngine:
+    """Stand-in for RenderEngine without torch, CUDA or a trained avatar.
+
+    Same interface and output files, frames are a flat gray image with a bar
+    moving with the audio level, produced at `fps` frames/s per render (default
+    $MOCK_FPS or 25) to simulate render cost. For load tests and capacity
+    planning on machines without a GPU: RENDER_BACKEND=mock.
+    """
+
+    def __init__(self, data_root, workspace, portrait=True, extra_args=None, max_concurrent=1, fps=None, size=(512, 512), **kwargs):
+        self.data_root = str(data_root)
+        self.workspace = str(workspace)
+        self.args = ["mock", *(extra_args or [])]
+        self.fps = fps or float(os.environ.get("MOCK_FPS", "25"))
+        self.size = size
+        self.slots = threading.Semaphore(max_concurrent)
+        self.batcher = None
+        print(f"[INFO] mock render engine ready ({self.workspace}, {self.fps} fps)")
+
+    def close(self):
+        pass
+
+    def render(self, wav_path, save_path=None, name=None, progress=None, frame_offset=0, num_frames=None, mux=True, pcm=None, writer=None,
+               context=(0, 0)):
+        import numpy as np
+        import wave
+        from video_stream import StreamWriter
+
+        if pcm is None:
+            with wave.open(str(wav_path), "rb") as f:
+                assert f.getsampwidth() == 2, "mock backend reads 16-bit PCM wavs only"
+                sample_rate = f.getframerate()
+                data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).reshape(-1, f.getnchannels())
+                pcm = data[:, 0].astype(np.float32) / 32768
+        else:
+            sample_rate = 16000
+        hop = sample_rate // 25
+        if context != (0, 0):
+            pcm = pcm[context[0] * hop:len(pcm) - context[1] * hop] # no features, the context is not needed
+        if num_frames is None:
+            num_frames = len(pcm) // hop + 1
+
+        save_path = save_path or os.path.join(self.workspace, "results")
+        name = name or "mock"
+        os.makedirs(save_path, exist_ok=True)
+        out_path = os.path.join(save_path, f"{name}_audio.mp4")
+
+        own_writer = writer is None
+        if own_writer:
+            writer = StreamWriter(out_path, fps=25, sample_rate=sample_rate)
+            writer.write_audio(pcm)
+
+        H, W = self.size
+        with self.slots:
+            try:
+                t = time.time()
+                for i in range(num_frames):
+                    level = float(np.abs(pcm[i * hop:(i + 1) * hop]).mean()) if i * hop < len(pcm) else 0.0
+                    frame = np.full((H, W, 3), 128, dtype=np.uint8)
+                    bar = int(min(level * 8, 1) * H)
+                    frame[H - bar:, W // 2 - 20:W // 2 + 20] = 255
+                    # simulated render cost
+                    time.sleep(max(0.0, t + (i + 1) / self.fps - time.time()))
+                    writer.write_frame(frame)
+                    if progress is not None:
+                        progress(i + 1, num_frames)
+            except BaseException:
+                if own_writer:
+                    writer.abort()
+                raise
+            if own_writer:
+                writer.close()
+
+        return out_path if own_writer else None
@@ -0,0 +1,144 @@
+# retention.py
+"""
+Retention of per-request work directories under an age and byte budget.
+
+Every request renders in its own directory under `root` (results/jobs/<id>).
+The services register it when it is created and report the final artifact
+when the job ends: everything else in the directory (input wav, silent and
+depth mp4, partial output of a failed render) is deleted right away. Finished
+directories are then evicted, oldest first, once older than `max_age` seconds
+or while the total is over `max_bytes`. Directories of running jobs are never
+touched; untracked ones (left over from an earlier run) count as finished.
+
+usage() is cheap enough for every metrics scrape: the bytes under `root` are
+measured by each sweep and kept up to date by finish() and evictions, so
+between sweeps they miss only what running jobs wrote since.
+
+    RETENTION = Retention(JOBS_DIR, max_bytes=5 << 30, max_age=24 * 3600)
+    RETENTION.start()                          # sweeps every `interval` seconds
+    RETENTION.track(work_dir)
+    ...
+    RETENTION.finish(work_dir, keep=result)    # keep=None: the result lives elsewhere, drop the dir
+"""
+import os, shutil, threading, time
+from pathlib import Path
+
+
+def dir_bytes(path):
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class Retention:
+    def __init__(self, root, max_bytes, max_age=None, interval=300):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = set() # work dirs of jobs still running
+        self.evicted = 0
+        self.freed_bytes = 0
+        self.jobs_bytes = None # bytes under root as of the last sweep, minus what was removed since
+
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def track(self, work_dir):
+        with self.lock:
+            self.active.add(os.path.abspath(work_dir))
+
+    def finish(self, work_dir, keep=None):
+        # job over: delete everything in work_dir but `keep` (the whole dir when keep is None / elsewhere)
+        work_dir = Path(work_dir)
+        keep = Path(keep).resolve() if keep is not None else None
+        freed = 0
+        if keep is not None and keep.parent == work_dir.resolve():
+            for p in work_dir.iterdir():
+                if p.resolve() != keep:
+                    freed += self._remove(p)
+        else:
+            freed += self._remove(work_dir)
+        with self.lock:
+            self.active.discard(os.path.abspath(work_dir))
+            self.freed_bytes += freed
+            if self.jobs_bytes is not None:
+                self.jobs_bytes = max(0, self.jobs_bytes - freed)
+
+    def sweep(self):
+        # evict finished dirs past max_age, then oldest first until under max_bytes; returns dirs removed
+        now = time.time()
+        with self.lock:
+            active = set(self.active)
+        entries = []
+        for p in self.root.iterdir():
+            if os.path.abspath(p) in active:
+                continue
+            try:
+                entries.append((p.stat().st_mtime, p, dir_bytes(p) if p.is_dir() else p.stat().st_size))
+            except OSError:
+                pass
+        entries.sort(key=lambda e: e[0])
+
+        total = sum(size for _, _, size in entries) + sum(dir_bytes(d) for d in active if os.path.isdir(d))
+        removed = 0
+        for mtime, p, size in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            total -= size
+            self._remove(p)
+            removed += 1
+            with self.lock:
+                self.evicted += 1
+                self.freed_bytes += size
+        with self.lock:
+            self.jobs_bytes = total
+        if removed:
+            print(f"[INFO] retention: evicted {removed} job dir(s), {total / 2**20:.0f} MiB left in {self.root}")
+        return removed
+
+    def start(self):
+        def loop():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"[WARN] retention sweep failed: {e}")
+                time.sleep(self.interval)
+        threading.Thread(target=loop, name="retention", daemon=True).start()
+
+    def usage(self):
+        # jobs_bytes as of the last sweep (see the module docstring), the rest is live (one listdir, no walk)
+        if self.jobs_bytes is None:
+            self.sweep()
+        disk = shutil.disk_usage(self.root)
+        with self.lock:
+            active = len(self.active)
+            jobs_bytes = self.jobs_bytes
+        return {
+            "jobs_bytes": jobs_bytes,
+            "jobs_dirs": sum(1 for _ in os.scandir(self.root)),
+            "active": active,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "evicted": self.evicted,
+            "freed_bytes": self.freed_bytes,
+            "disk": {"total": disk.total, "used": disk.used, "free": disk.free},
+        }
+
+    def _remove(self, p):
+        size = dir_bytes(p) if p.is_dir() else (p.stat().st_size if p.exists() else 0)
+        if p.is_dir():
+            shutil.rmtree(p, ignore_errors=True)
+        else:
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+        return size
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Replay a JSONL file of requests against a running server.py or gpu_worker.py
+and report throughput, latency percentiles, time-to-first-byte and errors.
+
+Each line is a JSON object with (all optional except the text):
+  text   (or body / title, e.g. the repo's requests.jsonl)
+  avatar
+  offset seconds after the start at which to send it (arrival trace)
+
+Open loop: requests are sent at their arrival time whether or not earlier ones
+finished, so an overloaded service shows up as growing latency / 429s instead
+of a slower client.
+
+Usage:
+  # server.py, arrival offsets from the file (or 1 req/s when there are none)
+  python scripts/load_test.py requests.jsonl --url http://localhost:8000 --endpoint /stream
+
+  # fixed Poisson arrival rate, 200 requests
+  python scripts/load_test.py requests.jsonl --rate 2 --limit 200 --endpoint /generate
+
+  # gpu_worker.py: every request uploads the same wav
+  python scripts/load_test.py requests.jsonl --url http://localhost:8000 --endpoint /render --wav demo/test.wav
+
+Without a GPU, start the service with RENDER_BACKEND=mock (MOCK_FPS=<frames/s
+per render>) and TTS_BACKEND=local for capacity planning.
+"""
+import argparse, json, random, sys, threading, time, uuid
+import urllib.request, urllib.error, urllib.parse
+
+
+def load_requests(path, limit=None):
+    reqs = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            r = json.loads(line)
+            text = r.get("text") or r.get("body") or r.get("title")
+            if not text:
+                continue
+            reqs.append({"text": text, "avatar": r.get("avatar"), "offset": r.get("offset")})
+            if limit and len(reqs) >= limit:
+                break
+    return reqs
+
+
+def schedule(reqs, rate=None, arrival="poisson", seed=0):
+    # arrival offsets (seconds): from --rate, else from the file, else 1 req/s
+    rng = random.Random(seed)
+    if rate is None and all(r["offset"] is not None for r in reqs):
+        return [float(r["offset"]) for r in reqs]
+    rate = rate or 1.0
+    t, offsets = 0.0, []
+    for _ in reqs:
+        offsets.append(t)
+        t += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+    return offsets
+
+
+def multipart(fields, files):
+    # fields: {name: str}, files: {name: (filename, bytes, content type)}
+    boundary = uuid.uuid4().hex
+    body = b""
+    for k, v in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+    for k, (filename, data, ctype) in files.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"; filename="{filename}"\r\nContent-Type: {ctype}\r\n\r\n'.encode()
+        body += data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def build_request(args, req, wav_bytes):
+    fields = {}
+    if req["avatar"] or args.avatar:
+        fields["avatar"] = req["avatar"] or args.avatar
+    if wav_bytes is not None:
+        body, ctype = multipart(fields, {"wav": ("input.wav", wav_bytes, "audio/wav")})
+    else:
+        fields["text"] = req["text"]
+        body, ctype = urllib.parse.urlencode(fields).encode(), "application/x-www-form-urlencoded"
+    return urllib.request.Request(args.url.rstrip("/") + args.endpoint, data=body, headers={"Content-Type": ctype}, method="POST")
+
+
+def read_body(resp, row, t0):
+    # first byte -> ttfb, then drain
+    first = resp.read(1)
+    row["ttfb"] = time.time() - t0
+    n = len(first)
+    while True:
+        chunk = resp.read(64 << 10)
+        if not chunk:
+            break
+        n += len(chunk)
+    row["bytes"] = n
+
+
+def run_one(args, req, wav_bytes, row):
+    t0 = time.time()
+    row["sent_at"] = t0
+    try:
+        with urllib.request.urlopen(build_request(args, req, wav_bytes), timeout=args.timeout) as resp:
+            row["status"] = resp.status
+            if args.endpoint.rstrip("/") == "/jobs":
+                # async API: poll, then fetch the result
+                job = json.loads(resp.read())
+                base = args.url.rstrip("/")
+                while True:
+                    with urllib.request.urlopen(base + job["status_url"], timeout=args.timeout) as s:
+                        status = json.loads(s.read())["status"]
+                    if status in ("done", "failed"):
+                        break
+                    time.sleep(args.poll)
+                with urllib.request.urlopen(base + job["result_url"], timeout=args.timeout) as r:
+                    row["status"] = r.status
+                    read_body(r, row, t0)
+            else:
+                read_body(resp, row, t0)
+    except urllib.error.HTTPError as e:
+        row["status"] = e.code
+        row["retry_after"] = e.headers.get("Retry-After")
+    except Exception as e:
+        row["status"] = None
+        row["error"] = repr(e)
+    row["latency"] = time.time() - t0
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def summarize(rows, wall):
+    ok = [r for r in rows if r.get("status") is not None and 200 <= r["status"] < 300]
+    rejected = [r for r in rows if r.get("status") in (429, 503)]
+    errors = [r for r in rows if r not in ok and r not in rejected]
+    lat = [r["latency"] for r in ok]
+    ttfb = [r["ttfb"] for r in ok if "ttfb" in r]
+    fmt = lambda v: "-" if v is None else f"{v:.3f}s"
+
+    summary = {
+        "requests": len(rows),
+        "ok": len(ok),
+        "rejected": len(rejected),
+        "errors": len(errors),
+        "error_rate": (len(errors) + len(rejected)) / max(len(rows), 1),
+        "wall_s": wall,
+        "throughput_rps": len(ok) / wall if wall > 0 else 0.0,
+        "latency": {f"p{p}": percentile(lat, p) for p in (50, 95, 99)},
+        "ttfb": {f"p{p}": percentile(ttfb, p) for p in (50, 95, 99)},
+    }
+    print(f"[INFO] {summary['requests']} requests in {wall:.1f}s: {len(ok)} ok, {len(rejected)} rejected (429/503), {len(errors)} errors")
+    print(f"[INFO] throughput {summary['throughput_rps']:.3f} req/s, error rate {summary['error_rate']:.1%}")
+    print("[INFO] latency  " + "  ".join(f"{k} {fmt(v)}" for k, v in summary["latency"].items()))
+    print("[INFO] ttfb     " + "  ".join(f"{k} {fmt(v)}" for k, v in summary["ttfb"].items()))
+    for r in errors[:5]:
+        print(f"[WARN] status {r.get('status')} {r.get('error', '')}")
+    return summary
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("requests", help="JSONL file, one request per line")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--endpoint", default="/stream", help="/generate, /stream, /jobs (server.py) or /render, /jobs (gpu_worker.py with --wav)")
+    p.add_argument("--wav", default=None, help="upload this wav with every request (gpu_worker.py)")
+    p.add_argument("--avatar", default=None, help="avatar for requests without one")
+    p.add_argument("--rate", type=float, default=None, help="open-loop arrival rate (req/s), overrides offsets in the file")
+    p.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    p.add_argument("--limit", type=int, default=None, help="replay at most this many requests")
+    p.add_argument("--timeout", type=float, default=600)
+    p.add_argument("--poll", type=float, default=0.5, help="status poll interval for /jobs")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default=None, help="write per-request rows and the summary as JSON")
+    args = p.parse_args()
+
+    reqs = load_requests(args.requests, args.limit)
+    if not reqs:
+        sys.exit(f"no requests in {args.requests}")
+    offsets = schedule(reqs, args.rate, args.arrival, args.seed)
+    wav_bytes = open(args.wav, "rb").read() if args.wav else None
+
+    print(f"[INFO] replaying {len(reqs)} requests against {args.url}{args.endpoint} over {offsets[-1]:.1f}s")
+    rows = [{"index": i, "offset": off} for i, off in enumerate(offsets)]
+    threads = []
+    start = time.time()
+    for req, off, row in zip(reqs, offsets, rows):
+        time.sleep(max(0.0, start + off - time.time()))
+        th = threading.Thread(target=run_one, args=(args, req, wav_bytes, row), daemon=True)
+        th.start()
+        threads.append(th)
+    for th in threads:
+        th.join()
+    wall = time.time() - start
+
+    summary = summarize(rows, wall)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+        print(f"[INFO] wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
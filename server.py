@@ -1,9 +1,20 @@
 from fastapi import FastAPI, Form
-from fastapi.responses import JSONResponse, HTMLResponse
-import subprocess, uuid, os, shlex, glob, shutil, sys
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, StreamingResponse, PlainTextResponse
+import subprocess, uuid, os, shlex, glob, shutil, sys, re, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 from fastapi.staticfiles import StaticFiles
 
+from avatars import AvatarRegistry, UnknownAvatar, load_avatars
+from nerf_triplane.telemetry import REGISTRY
+from jobs import Job, JobManager, Overloaded
+from disk_cache import DiskCache, cache_key, normalize_text
+from retention import Retention
+from assets import AssetManager, may_assets
+from tts import SAMPLE_RATE, get_backend, pad_to_frames
+from video_stream import StreamWriter, tail_file
+
 app = FastAPI()
 
 # --- Paths (self-relative) ---
@@ -13,9 +24,11 @@ DATA_ROOT   = PROJECT_ROOT / "data" / "May"
 WORKSPACE   = PROJECT_ROOT / "model" / "trial_may"
 DEMO_DIR    = PROJECT_ROOT / "demo"
 RESULTS_DIR = WORKSPACE / "results"
+JOBS_DIR    = RESULTS_DIR / "jobs"     # one working directory per request
 
 DEMO_DIR.mkdir(parents=True, exist_ok=True)
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+JOBS_DIR.mkdir(parents=True, exist_ok=True)
 
 print("[BOOT] PROJECT_ROOT:", PROJECT_ROOT)
 print("[BOOT] DATA_ROOT:", DATA_ROOT, "exists:", DATA_ROOT.is_dir())
@@ -27,139 +40,242 @@ app.mount(
     name="results",
 )
 
-GDRIVE_DATA_ID  = "18Q2H612CAReFxBd9kxr-i1dD8U1AUfsV"  # May.zip
-GDRIVE_MODEL_ID = "1C2639qi9jvhRygYHwPZDGs8pun3po3W7"  # trial_may.zip
-
-def _run(cmd:list):
-    proc = subprocess.run(cmd, text=True, capture_output=True)
-    if proc.returncode != 0:
-        print("CMD FAILED:", " ".join(cmd))
-        print("STDOUT:", proc.stdout)
-        print("STDERR:", proc.stderr)
-        raise RuntimeError(f"Command failed: {' '.join(cmd)}")
-    return proc.stdout
-
-def latest_audio_mp4(results_dir: Path) -> Path:
-    files = sorted(results_dir.glob("*_audio.mp4"), key=lambda p: p.stat().st_mtime, reverse=True)
-    if not files:
-        raise FileNotFoundError("No *_audio.mp4 found in results.")
-    return files[0]
-    
-def ensure_assets():
-    # Ensure gdown exists
+# number of jobs rendered concurrently (every endpoint goes through the job queue)
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "1"))
+# admission control: queued jobs at most, and the longest estimated wait we accept (seconds)
+MAX_QUEUE = int(os.environ.get("MAX_QUEUE", "16"))
+MAX_WAIT_S = float(os.environ.get("MAX_WAIT_S", "120"))
+# finished jobs answer /jobs/{id} this long / this many of them, then 410
+JOBS_KEEP = int(os.environ.get("JOBS_KEEP", "1000"))
+JOBS_TTL_S = float(os.environ.get("JOBS_TTL_S", "3600"))
+# speech rate used to estimate the audio duration of a text before TTS
+TTS_CHARS_PER_S = float(os.environ.get("TTS_CHARS_PER_S", "14"))
+# audio of the neighbouring sentences each piece sees, in video frames (0.6 s: at least 11 frames are left
+# once the start is aligned to 16 mel steps, over the 16 mel steps of an AVE window plus the 4 frames of the
+# attention window)
+AUDIO_CONTEXT_FRAMES = 15
+
+# content-addressed cache of final videos, served straight from /results/cache
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(2 << 30)))
+RESULT_CACHE = DiskCache(RESULTS_DIR / "cache", max_bytes=RESULT_CACHE_BYTES, suffix=".mp4")
+
+# per-request work dirs: intermediates go when the job ends, finished dirs by age / total size
+JOBS_MAX_BYTES = int(os.environ.get("JOBS_MAX_BYTES", str(2 << 30)))
+JOBS_MAX_AGE_S = float(os.environ.get("JOBS_MAX_AGE_S", str(24 * 3600)))
+RETENTION = Retention(JOBS_DIR, max_bytes=JOBS_MAX_BYTES, max_age=JOBS_MAX_AGE_S)
+RETENTION.start()
+
+# TTS backend from $TTS_BACKEND (gtts, or local for offline benchmarking), behind the phrase audio cache
+TTS = get_backend(cached=True)
+TTS_PARAMS = {**TTS.params(), "sample_rate": SAMPLE_RATE}
+
+# data/May and model/trial_may are verified (and fetched if missing) once at boot, see assets.py
+ASSETS = AssetManager(PROJECT_ROOT, may_assets(DATA_ROOT, WORKSPACE))
+
+# --- Avatars: id -> (data dir, workspace, checkpoint); engines stay resident, LRU-bounded ---
+# RENDER_BACKEND=mock renders placeholder frames without torch / GPU / assets (load tests, capacity planning).
+# nerf and mock only: text jobs stream their frames into a StreamWriter, so the engine has to be in process.
+RENDER_BACKEND = os.environ.get("RENDER_BACKEND", "nerf")
+if RENDER_BACKEND not in ("nerf", "mock"):
+    raise RuntimeError(f"RENDER_BACKEND={RENDER_BACKEND} is not supported by server.py, use nerf or mock")
+DEFAULT_AVATAR = os.environ.get("DEFAULT_AVATAR", "may")
+MAX_RESIDENT_AVATARS = int(os.environ.get("MAX_RESIDENT_AVATARS", "2"))
+AVATARS = AvatarRegistry(
+    load_avatars(os.environ.get("AVATARS_CONFIG", str(PROJECT_ROOT / "avatars.json")),
+                 defaults={"may": {"data": str(DATA_ROOT), "workspace": str(WORKSPACE)}}),
+    max_resident=MAX_RESIDENT_AVATARS, portrait=True, backend=RENDER_BACKEND, max_concurrent=RENDER_SLOTS,
+)
+
+@app.on_event("startup")
+def load_engine():
+    if RENDER_BACKEND != "mock" and not ASSETS.ensure():
+        raise RuntimeError(f"assets not ready: {ASSETS.status()}")
+    AVATARS.get(DEFAULT_AVATAR)  # warm: the default avatar is resident before the first request
+
+JOBS = JobManager(num_slots=RENDER_SLOTS, max_queue=MAX_QUEUE, max_wait=MAX_WAIT_S, max_finished=JOBS_KEEP, finished_ttl=JOBS_TTL_S)
+
+def job_not_found(job_id: str):
+    # 410 for finished jobs the manager already forgot, 404 for ids it never had
+    if JOBS.expired(job_id):
+        return JSONResponse({"error": "job expired", "id": job_id}, status_code=410)
+    return JSONResponse({"error": "unknown job"}, status_code=404)
+
+@app.exception_handler(Overloaded)
+def overloaded(request, exc: Overloaded):
+    # graceful degradation: tell the client when to come back instead of queueing without bound
+    return JSONResponse({"error": "overloaded", "reason": exc.reason, "retry_after": exc.retry_after},
+                        status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)})
+
+# --- Prometheus metrics: stage histograms live in nerf_triplane.telemetry, gauges are read at scrape time ---
+REGISTRY.gauge("synctalk_queue_depth", "jobs waiting for a render slot", fn=lambda: JOBS.queued)
+REGISTRY.gauge("synctalk_jobs_running", "jobs on a render slot", fn=lambda: JOBS.running)
+REGISTRY.gauge("synctalk_estimated_wait_seconds", "estimated queue wait of a new job", fn=JOBS.estimated_wait)
+REGISTRY.counter("synctalk_jobs_rejected_total", "jobs refused by admission control since start", fn=lambda: JOBS.rejected)
+REGISTRY.counter("synctalk_jobs_coalesced_total", "requests attached to an identical in-flight job since start", fn=lambda: JOBS.coalesced)
+REGISTRY.gauge("synctalk_render_fps", "measured frames/s per render slot", fn=lambda: JOBS.fps)
+REGISTRY.gauge("synctalk_resident_models", "avatar engines (NeRFNetwork + dataset) loaded", fn=lambda: len(AVATARS.resident()))
+REGISTRY.gauge("synctalk_cache_bytes", "bytes on disk per cache", label="cache",
+               fn=lambda: {"result": RESULT_CACHE.total_bytes(), "tts": TTS.cache.total_bytes()})
+REGISTRY.gauge("synctalk_jobs_dir_bytes", "bytes in per-request work dirs", fn=lambda: RETENTION.usage()["jobs_bytes"])
+REGISTRY.gauge("synctalk_disk_free_bytes", "free space on the results volume", fn=lambda: RETENTION.usage()["disk"]["free"])
+
+@app.exception_handler(UnknownAvatar)
+def unknown_avatar(request, exc: UnknownAvatar):
+    return JSONResponse({"error": "unknown avatar", "avatar": exc.args[0], "avatars": sorted(AVATARS.avatars)}, status_code=404)
+
+def estimate_frames(text: str) -> int:
+    # expected video length (25 fps) from the expected audio duration
+    return int(len(text) / TTS_CHARS_PER_S * 25) + 1
+
+def split_text(text: str, min_chars: int = 40) -> list:
+    # sentences / clauses, tiny pieces are merged into the previous one (one gTTS call each)
+    chunks = []
+    for piece in re.split(r"(?<=[.!?;:])\s+", text.strip()):
+        if chunks and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        elif piece:
+            chunks.append(piece)
+    return chunks or [text]
+
+def result_key(text: str, avatar: str) -> str:
+    # (normalized text, tts params, workspace, checkpoint, render flags); from the avatar spec, the engine
+    # is only loaded by the job on its render slot
+    return cache_key({"text": normalize_text(text), "tts": TTS_PARAMS, **AVATARS.cache_id(avatar)})
+
+def new_work_dir(job_id: str = None) -> Path:
+    # every request gets its own directory, so concurrent renders never share a file
+    work_dir = JOBS_DIR / (job_id or uuid.uuid4().hex)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    RETENTION.track(work_dir)
+    return work_dir
+
+def render_text(text: str, work_dir: Path, progress=None, avatar: str = DEFAULT_AVATAR, key: str = None) -> Path:
+    # TTS -> render -> result cache, returns the cached mp4.
+    # Pipelined per sentence: TTS of chunk k+1 runs while chunk k is rendered, the pieces
+    # continue the head pose sequence. Each piece gets AUDIO_CONTEXT_FRAMES of its neighbours' audio
+    # for the AVE features, so the lips do not reset at sentence boundaries; only the last
+    # AUDIO_CONTEXT_FRAMES of a piece wait for the TTS of the next one. Frames and audio are
+    # encoded as they come into a fragmented mp4 at work_dir/render_audio.mp4, which /jobs/{id}/stream
+    # serves while it grows.
+    engine = AVATARS.get(avatar)
+    chunks = split_text(text)
+    print(f"[INFO] {len(chunks)} text chunk(s), avatar {avatar}")
+
+    out_path = work_dir / "render_audio.mp4"
+    writer = StreamWriter(out_path, fps=25, sample_rate=SAMPLE_RATE)
+    frame_len = SAMPLE_RATE // 25
+    context_len = AUDIO_CONTEXT_FRAMES * frame_len
+    frames_done = 0
+    history = np.zeros(0, dtype=np.float32)  # last AUDIO_CONTEXT_FRAMES of the pieces rendered so far
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts") as tts:
+            pending = [tts.submit(lambda chunk: pad_to_frames(TTS.synthesize(chunk, SAMPLE_RATE), SAMPLE_RATE), chunk) for chunk in chunks]
+
+            def frames_total():
+                # frames of the whole job: synthesized pieces exactly, the others estimated from their text
+                return sum(len(f.result()) // frame_len if f.done() and f.exception() is None else estimate_frames(chunk)
+                           for f, chunk in zip(pending, chunks))
+
+            def render_frames(name, audio, audio_start, offset, num_frames, head):
+                # frames [offset, offset + num_frames) of the utterance; `audio` holds it from frame audio_start on,
+                # `head` is the audio that follows. Up to AUDIO_CONTEXT_FRAMES before them, starting at a multiple of
+                # 5 frames (16 mel steps) of the utterance so the mel windows line up with a single pass over the
+                # whole text, and up to AUDIO_CONTEXT_FRAMES after them.
+                before = min(offset - audio_start, AUDIO_CONTEXT_FRAMES)
+                before -= (before - offset) % 5
+                start = (offset - before - audio_start) * frame_len
+                piece = np.concatenate([audio[start:], head])[:(before + num_frames) * frame_len + context_len]
+                after = len(piece) // frame_len - before - num_frames
+
+                chunk_progress = None
+                if progress is not None:
+                    chunk_progress = lambda done, total: progress(offset + done, frames_total())
+                engine.render(None, save_path=str(work_dir), name=name, progress=chunk_progress,
+                              frame_offset=offset, num_frames=num_frames, pcm=piece, writer=writer, context=(before, after))
+
+            for k, future in enumerate(pending):
+                pcm = future.result()
+                num_frames = len(pcm) // frame_len
+                audio = np.concatenate([history, pcm])
+                audio_start = frames_done - len(history) // frame_len
+
+                # audio first: the encoder interleaves it ahead of the frames it covers
+                writer.write_audio(pcm)
+                # frames whose right context lies in this piece are rendered while the next piece is synthesized,
+                # only the last AUDIO_CONTEXT_FRAMES wait for the head of the next piece
+                body = num_frames if k + 1 == len(pending) else max(0, num_frames - AUDIO_CONTEXT_FRAMES)
+                if body:
+                    render_frames(f"render_{k:03d}", audio, audio_start, frames_done, body, pcm[:0])
+                if body < num_frames:
+                    head = pending[k + 1].result()[:context_len]
+                    render_frames(f"render_{k:03d}_end", audio, audio_start, frames_done + body, num_frames - body, head)
+                frames_done += num_frames
+                history = audio[-context_len:]
+    except BaseException:
+        writer.abort()  # close() would raise over the render error
+        raise
+    writer.close()
+
+    return RESULT_CACHE.put(key or result_key(text, avatar), out_path, move=True)
+
+def run_text_job(job: Job, text: str, avatar: str, key: str):
+    # runs on a render slot of JOBS. the caller already missed the result cache with `key`.
+    work_dir = new_work_dir(job.id)
+    job.output = str(work_dir / "render_audio.mp4")  # growing file, for /jobs/{id}/stream
+    result = None
     try:
-        _run(["gdown", "--version"])
-    except Exception:
-        _run([sys.executable, "-m", "pip", "install", "gdown"])
-
-    # DATA (May)
-    if not DATA_ROOT.is_dir():
-        (PROJECT_ROOT / "data").mkdir(parents=True, exist_ok=True)
-        zip_path = PROJECT_ROOT / "data" / "May.zip"
-        print("[BOOT] Downloading May.zip…")
-        _run(["gdown", "--fuzzy", f"https://drive.google.com/uc?id={GDRIVE_DATA_ID}", "-O", str(zip_path)])
-        print("[BOOT] Unzipping May.zip…")
-        _run(["unzip", "-o", str(zip_path), "-d", str(PROJECT_ROOT / "data")])
-        try: zip_path.unlink()
-        except: pass
-        if not DATA_ROOT.is_dir():
-            # Try to normalize folder name to "May"
-            candidates = [p for p in (PROJECT_ROOT / "data").glob("*") if p.is_dir()]
-            pick = next((p for p in candidates if p.name.lower() == "may"), candidates[0] if candidates else None)
-            if pick and pick != DATA_ROOT:
-                print(f"[BOOT] Renaming '{pick}' -> '{DATA_ROOT}'")
-                if DATA_ROOT.exists():
-                    shutil.rmtree(DATA_ROOT)
-                shutil.move(str(pick), str(DATA_ROOT))
-
-    # MODEL (trial_may)
-    if not WORKSPACE.is_dir():
-        (PROJECT_ROOT / "model").mkdir(parents=True, exist_ok=True)
-        zip_path = PROJECT_ROOT / "model" / "trial_may.zip"
-        print("[BOOT] Downloading trial_may.zip…")
-        _run(["gdown", "--fuzzy", f"https://drive.google.com/uc?id={GDRIVE_MODEL_ID}", "-O", str(zip_path)])
-        print("[BOOT] Unzipping trial_may.zip…")
-        _run(["unzip", "-o", str(zip_path), "-d", str(PROJECT_ROOT / "model")])
-        try: zip_path.unlink()
-        except: pass
-        if not WORKSPACE.is_dir():
-            candidates = [p for p in (PROJECT_ROOT / "model").glob("*") if p.is_dir()]
-            pick = next((p for p in candidates if p.name.lower() == "trial_may"), candidates[0] if candidates else None)
-            if pick and pick != WORKSPACE:
-                print(f"[BOOT] Renaming '{pick}' -> '{WORKSPACE}'")
-                if WORKSPACE.exists():
-                    shutil.rmtree(WORKSPACE)
-                shutil.move(str(pick), str(WORKSPACE))
-
-    # Debug tree (use PROJECT_ROOT, not /app)
-    def ls(p: Path):
-        try:
-            return os.listdir(p)
-        except Exception as e:
-            return f"<err: {e}>"
-    print("[BOOT] PROJECT_ROOT contents:", ls(PROJECT_ROOT))
-    print("[BOOT] DATA dir contents:", ls(PROJECT_ROOT / "data"))
-    print("[BOOT] MODEL dir contents:", ls(PROJECT_ROOT / "model"))
-    print("[BOOT] DATA_ROOT exists:", DATA_ROOT.is_dir(), DATA_ROOT)
-    print("[BOOT] WORKSPACE exists:", WORKSPACE.is_dir(), WORKSPACE)
+        result = render_text(text, work_dir, progress=job.progress, avatar=avatar, key=key)
+        return str(result)
+    finally:
+        # the result was moved into the cache (or stays here, when larger than the whole cache), nothing
+        # else in the work dir is needed anymore (open streams keep reading a partial output of a failed render until EOF)
+        RETENTION.finish(work_dir, keep=result)
+
+def submit_text_job(text: str, avatar: str, key: str) -> Job:
+    # single flight: identical requests (same result key) in flight share one job and its artifact
+    return JOBS.submit(run_text_job, text, avatar, key, frames=estimate_frames(text), key=key)
+
+def stream_job(job: Job):
+    # progressive mp4 body: the fragments written so far, then new ones as they are encoded
+    job.first_frame.wait()  # still queued / first frame not rendered yet, the output exists once it is set
+    try:
+        f = open(job.output, "rb")
+    except (TypeError, OSError):
+        # finished meanwhile (output moved into the result cache) or never started
+        if job.status == Job.DONE:
+            return FileResponse(job.result, media_type="video/mp4")
+        return JSONResponse(job.to_dict(), status_code=500)
+    return StreamingResponse(tail_file(f, done=job.finished.is_set), media_type="video/mp4")
 
 @app.get("/")
 def index():
-    return HTMLResponse("""
+    return HTMLResponse(f"""
     <html><body style='font-family:system-ui'>
       <h2>Text → Talking Face Demo</h2>
       <form action="/generate" method="post">
         <textarea name="text" rows="4" cols="60" placeholder="Type something..."></textarea><br><br>
+        <label>Avatar <input name="avatar" value="{DEFAULT_AVATAR}"/></label><br><br>
         <input type="submit" value="Generate Video">
       </form>
     </body></html>
     """)
 
 @app.post("/generate")
-def generate(text: str = Form(...)):
-    # use gTTS
-    from gtts import gTTS
-    from pydub import AudioSegment
-    
-    # 1. Generate WAV from text
-    mp3_path = os.path.join(DEMO_DIR, "input.mp3")
-    wav_path = str(DEMO_DIR / "input.wav")
-    
-    tts = gTTS(text)
-    tts.save(mp3_path)
-    
-    audio = AudioSegment.from_mp3(mp3_path)
-    audio = audio.set_frame_rate(48000).set_channels(1).set_sample_width(2)  # 48k, mono, 16-bit
-    audio.export(wav_path, format="wav")
-
-    ensure_assets()
-
-    assert DATA_ROOT.is_dir(), f"Missing DATA_ROOT: {DATA_ROOT}"
-    assert WORKSPACE.is_dir(), f"Missing WORKSPACE: {WORKSPACE}"
-    assert os.path.exists(wav_path) and os.path.getsize(wav_path) > 0, "WAV not created or empty"
-
-    # 2. Run your generator
-    cmd = [
-        sys.executable,                          # <-- was "python"
-        str(PROJECT_ROOT / "main.py"),
-        str(DATA_ROOT),
-        "--workspace", str(WORKSPACE),
-        "-O", "--test", "--test_train",
-        "--asr_model", "ave",
-        "--portrait",
-        "--aud", wav_path,
-    ]    
-    
-    # ensure imports resolve in the child too
-    child_env = os.environ.copy()
-    child_env["PYTHONPATH"] = f"{PROJECT_ROOT}:{child_env.get('PYTHONPATH','')}"
-    
-    subprocess.run(cmd, check=True, env=child_env)
-
-    #subprocess.run(shlex.split(cmd), check=True)
-
-    out_path = latest_audio_mp4(RESULTS_DIR)
-    rel_url = f"/results/{out_path.name}"
+def generate(text: str = Form(...), avatar: str = Form(DEFAULT_AVATAR)):
+    # 0. Repeated prompts are served from the result cache
+    key = result_key(text, avatar)
+    out_path = RESULT_CACHE.get(key)
+
+    if out_path is None:
+        # 1. Generate WAV from text, 2. render with the resident engine, on a render slot (bounded, may raise Overloaded),
+        #    or wait for the identical request already rendering
+        job = submit_text_job(text, avatar, key)
+        job.finished.wait()
+        if job.status == Job.FAILED:
+            return JSONResponse(job.to_dict(), status_code=500)
+        out_path = Path(job.result)
+
+    rel_url = f"/results/{out_path.relative_to(RESULTS_DIR).as_posix()}"
     cache_bust = uuid.uuid4().hex  # force fresh load
 
     return HTMLResponse(f"""
@@ -191,6 +307,83 @@ def generate(text: str = Form(...)):
     </html>
     """)
 
+# --- Async jobs: submit, poll, fetch ---
+@app.post("/jobs", status_code=202)
+def submit_job(text: str = Form(...), avatar: str = Form(DEFAULT_AVATAR)):
+    key = result_key(text, avatar)
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        job = JOBS.complete(str(cached))
+    else:
+        job = submit_text_job(text, avatar, key)
+    return {"id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result"}
+
+@app.post("/stream")
+def stream(text: str = Form(...), avatar: str = Form(DEFAULT_AVATAR)):
+    # submit and stream in one call: the response body starts with the first rendered second
+    key = result_key(text, avatar)
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        return FileResponse(str(cached), media_type="video/mp4")
+    return stream_job(submit_text_job(text, avatar, key))
+
+@app.get("/jobs/{job_id}/stream")
+def job_stream(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    if job.status == Job.FAILED:
+        return JSONResponse(job.to_dict(), status_code=500)
+    return stream_job(job)
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    if job.status == Job.FAILED:
+        return JSONResponse(job.to_dict(), status_code=500)
+    if job.status != Job.DONE:
+        return JSONResponse(job.to_dict(), status_code=409)
+    if not os.path.exists(job.result):
+        return JSONResponse({"error": "result evicted", **job.to_dict()}, status_code=410)
+    return FileResponse(job.result, media_type="video/mp4", filename=os.path.basename(job.result))
+
+@app.get("/health")
+def health():
+    engine_loaded = DEFAULT_AVATAR in AVATARS.resident()
+    assets_ok = RENDER_BACKEND == "mock" or ASSETS.ready()
+    return {"ok": engine_loaded and assets_ok, "engine_loaded": engine_loaded, **ASSETS.status()}
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.expose(), media_type="text/plain; version=0.0.4")
+
+@app.get("/avatars")
+def avatar_stats():
+    return AVATARS.stats()
+
+@app.get("/queue")
+def queue_stats():
+    # queue depth, estimated wait and measured render speed
+    return JOBS.stats()
+
+@app.get("/cache")
+def cache_stats():
+    return {**RESULT_CACHE.stats(), "tts": TTS.stats()}
+
+@app.get("/disk")
+def disk_usage():
+    # work dirs, caches (bounded by their own budgets) and free space on the volume
+    return {**RETENTION.usage(), "cache_bytes": {"result": RESULT_CACHE.total_bytes(), "tts": TTS.cache.total_bytes()}}
+
 @app.get("/file")
 def serve_file(path: str):
     return JSONResponse({"error": "serve with nginx"}, status_code=404)
@@ -0,0 +1,62 @@
+# the batched offline wav2vec features (asr.extract_feats, --bulk) against the streaming file mode of ASR,
+# on a tiny random Wav2Vec2ForCTC: the same windows must give the same features.
+import argparse, os, sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+sf = pytest.importorskip('soundfile')
+pytest.importorskip('resampy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nerf_triplane.asr import ASR, extract_feats, read_wav
+
+
+class TinyProcessor:
+    # the processor interface ASR / extract_feats use, without a tokenizer to download
+    def __init__(self):
+        self.feature_extractor = transformers.Wav2Vec2FeatureExtractor(do_normalize=True)
+
+    def __call__(self, *args, **kwargs):
+        return self.feature_extractor(*args, **kwargs)
+
+    def batch_decode(self, ids):
+        return [''] * len(ids)
+
+
+@pytest.fixture(scope='module')
+def tiny_asr():
+    torch.manual_seed(0)
+    config = transformers.Wav2Vec2Config(vocab_size=32, hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                                         intermediate_size=128)
+    return TinyProcessor(), transformers.Wav2Vec2ForCTC(config).eval()
+
+
+def stream_feats(wav, processor, model):
+    opt = argparse.Namespace(asr_wav=wav, asr_play=False, asr_model='tiny', asr_save_feats=False, asr_incremental=False,
+                             fps=50, l=10, m=50, r=10)
+    asr = ASR(opt, processor=processor, model=model, collect_feats=True)
+    while not asr.terminated:
+        asr.run_step()
+    return asr.feats
+
+
+@pytest.mark.parametrize('num_samples', [
+    16000 * 6 + 123,  # several windows, the last 20 ms chunk is short
+    320 * 70 - 100,   # a bit less than one full window
+    5000,             # shorter than one window
+])
+def test_bulk_matches_streaming(tiny_asr, tmp_path, num_samples):
+    processor, model = tiny_asr
+    rng = np.random.default_rng(num_samples)
+    t = np.arange(num_samples)
+    wav = str(tmp_path / 'speech.wav')
+    sf.write(wav, (0.3 * np.sin(t / 7) + 0.05 * rng.standard_normal(num_samples)).astype(np.float32), 16000)
+
+    streamed = stream_feats(wav, processor, model)
+    bulk = extract_feats(read_wav(wav), processor, model, batch_size=4)
+
+    assert bulk.shape == streamed.shape
+    assert (bulk - streamed).abs().max().item() < 1e-4
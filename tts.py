@@ -0,0 +1,185 @@
+# tts.py
+"""
+Text to speech backends returning PCM in memory.
+
+Every backend returns mono float32 samples in [-1, 1] at the requested sample
+rate (16 kHz is what the AVE / mel feature extractor consumes), so no MP3 temp
+file, WAV re-encode or second resample is needed on the way to the renderer.
+
+    tts = get_backend("gtts")            # or "local" for offline, deterministic audio
+    tts = CachedTTSBackend(tts)          # phrase-level audio cache on disk
+    pcm = tts.synthesize("Hello!", 16000)
+    write_wav("input.wav", pcm, 16000)   # only needed for muxing the final video
+"""
+import io, os, re, wave, zlib
+from pathlib import Path
+import numpy as np
+
+from disk_cache import DiskCache, cache_key, normalize_text
+from nerf_triplane.telemetry import TTS_SECONDS
+
+SAMPLE_RATE = 16000  # what nerf_triplane's AudDataset / AVE encoder expect
+
+# phrase audio shared by every TTS entry point (server.py, RunTalkingFace.py)
+TTS_CACHE_DIR = Path(os.environ.get("TTS_CACHE_DIR", Path(__file__).resolve().parent / "model" / "tts_cache"))
+TTS_CACHE_BYTES = int(os.environ.get("TTS_CACHE_BYTES", str(256 << 20)))
+
+
+class TTSBackend:
+    name = None
+
+    def synthesize(self, text, sample_rate=SAMPLE_RATE):
+        # -> np.float32 [num_samples], mono, in [-1, 1]
+        raise NotImplementedError()
+
+    def params(self):
+        # everything besides the text that changes the audio, used in cache keys
+        return {"engine": self.name}
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def __init__(self, lang="en", tld="com"):
+        self.lang = lang
+        self.tld = tld
+
+    def synthesize(self, text, sample_rate=SAMPLE_RATE):
+        from gtts import gTTS
+        from pydub import AudioSegment
+
+        # MP3 stays in memory, decoded and resampled once, straight to the target rate
+        with TTS_SECONDS.time(engine=self.name):
+            mp3 = io.BytesIO()
+            gTTS(text, lang=self.lang, tld=self.tld).write_to_fp(mp3)
+            mp3.seek(0)
+            audio = AudioSegment.from_file(mp3, format="mp3")
+            audio = audio.set_frame_rate(sample_rate).set_channels(1).set_sample_width(2)
+        return np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32) / 32768
+
+    def params(self):
+        return {"engine": self.name, "lang": self.lang, "voice": self.tld}
+
+
+class LocalTTSBackend(TTSBackend):
+    """Deterministic offline stand-in: not speech, but speech-like audio for benchmarks and tests.
+
+    Vowels become short harmonic tones, other letters seeded noise bursts, spaces
+    and punctuation pauses. The same text always gives the same samples and the
+    duration grows with the text like real TTS (~14 characters per second).
+    """
+    name = "local"
+
+    VOWELS = "aeiouy"
+
+    def __init__(self, char_ms=70, pause_ms=250, pitch=140):
+        self.char_ms = char_ms
+        self.pause_ms = pause_ms
+        self.pitch = pitch
+
+    def synthesize(self, text, sample_rate=SAMPLE_RATE):
+        with TTS_SECONDS.time(engine=self.name):
+            return self._synthesize(text, sample_rate)
+
+    def _synthesize(self, text, sample_rate):
+        pieces = [np.zeros(int(sample_rate * 0.1), dtype=np.float32)]  # leading silence like gTTS
+        n = int(sample_rate * self.char_ms / 1000)
+        t = np.arange(n, dtype=np.float32) / sample_rate
+        envelope = np.hanning(n).astype(np.float32)
+
+        for c in text.lower():
+            if c.isspace():
+                pieces.append(np.zeros(n // 2, dtype=np.float32))
+            elif c in ".,!?;:":
+                pieces.append(np.zeros(int(sample_rate * self.pause_ms / 1000), dtype=np.float32))
+            elif c in self.VOWELS:
+                # fundamental + two formant-ish harmonics, fixed per vowel
+                k = self.VOWELS.index(c)
+                f0 = self.pitch * (1 + 0.05 * k)
+                tone = np.sin(2 * np.pi * f0 * t) + 0.5 * np.sin(2 * np.pi * f0 * (3 + k) * t) + 0.25 * np.sin(2 * np.pi * f0 * (7 + k) * t)
+                pieces.append(0.3 * tone.astype(np.float32) * envelope)
+            elif c.isalnum():
+                rng = np.random.default_rng(zlib.crc32(c.encode("utf-8")))
+                pieces.append(0.1 * rng.standard_normal(n).astype(np.float32) * envelope)
+
+        pieces.append(np.zeros(int(sample_rate * 0.1), dtype=np.float32))
+        return np.concatenate(pieces)
+
+    def params(self):
+        return {"engine": self.name, "char_ms": self.char_ms, "pause_ms": self.pause_ms, "pitch": self.pitch}
+
+
+def split_phrases(text):
+    # clause-sized pieces that recur across responses ("Hello!", "Thanks for waiting,", ...)
+    return [p for p in re.split(r"(?<=[,.!?;:])\s+", text.strip()) if p]
+
+
+class CachedTTSBackend(TTSBackend):
+    """Phrase-level audio cache in front of another backend.
+
+    Text is split into phrases, each is looked up by (text, backend params,
+    sample rate) and only missing ones are synthesized. Audio is stored as raw
+    16-bit mono PCM in a DiskCache (LRU under `max_bytes`), so a response made
+    of known phrases is just a concatenation, no TTS call at all.
+    """
+
+    def __init__(self, backend, root=None, max_bytes=None):
+        self.backend = backend
+        self.name = backend.name
+        self.cache = DiskCache(root or TTS_CACHE_DIR, max_bytes=max_bytes or TTS_CACHE_BYTES, suffix=".pcm")
+
+    def synthesize(self, text, sample_rate=SAMPLE_RATE):
+        pieces = [self.synthesize_phrase(p, sample_rate) for p in split_phrases(text)]
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+    def synthesize_phrase(self, phrase, sample_rate=SAMPLE_RATE):
+        key = cache_key({"text": normalize_text(phrase), **self.backend.params(), "sample_rate": sample_rate})
+        path = self.cache.get(key)
+        if path is not None:
+            return np.fromfile(path, dtype=np.int16).astype(np.float32) / 32768
+
+        pcm = self.backend.synthesize(phrase, sample_rate)
+        data = (np.clip(pcm, -1, 1) * 32767).astype(np.int16)
+        self.cache.put_bytes(key, data.tobytes())
+        return data.astype(np.float32) / 32768  # same samples as a later cache hit
+
+    def params(self):
+        return self.backend.params()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+BACKENDS = {
+    "gtts": GTTSBackend,
+    "local": LocalTTSBackend,
+}
+
+
+def get_backend(name=None, cached=False, **kwargs):
+    # name defaults to $TTS_BACKEND, then gtts. cached: wrap in the shared phrase cache
+    name = name or os.environ.get("TTS_BACKEND", "gtts")
+    if name not in BACKENDS:
+        raise ValueError(f"unknown TTS backend {name!r}, choose from {sorted(BACKENDS)}")
+    backend = BACKENDS[name](**kwargs)
+    return CachedTTSBackend(backend) if cached else backend
+
+
+def pad_to_frames(pcm, sample_rate=SAMPLE_RATE, fps=25):
+    # pad with silence to a whole number of video frames, so pieces can be concatenated without drift
+    frame_len = sample_rate // fps
+    pad = -len(pcm) % frame_len
+    return np.concatenate([pcm, np.zeros(pad, dtype=pcm.dtype)]) if pad else pcm
+
+
+def write_wav(path, pcm, sample_rate=SAMPLE_RATE, channels=1):
+    # float32 [-1, 1] -> 16-bit PCM wav
+    data = (np.clip(pcm, -1, 1) * 32767).astype(np.int16)
+    if channels > 1:
+        data = np.repeat(data[:, None], channels, axis=1)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(data.tobytes())
+    return path
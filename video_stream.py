@@ -0,0 +1,141 @@
+# video_stream.py
+"""
+Incremental video encoding: frames and audio go into one ffmpeg process as
+they are produced, the output is a fragmented MP4 (one fragment per second)
+that can be served while it is still being written.
+
+    writer = StreamWriter("work/render_audio.mp4")
+    writer.write_audio(pcm)            # 16 kHz mono float, ahead of the frames it covers
+    for frame in frames:               # uint8 [H, W, 3]
+        writer.write_frame(frame)
+    writer.close()                     # finished, still a regular playable mp4
+                                       # (writer.abort() instead when the render failed)
+
+    for data in tail_file(open(path, "rb"), done=job.finished.is_set): ...   # progressive HTTP body
+"""
+import os, subprocess, tempfile, threading, time
+from queue import Queue
+import numpy as np
+
+from nerf_triplane.telemetry import ENCODE_SECONDS
+
+
+class StreamWriter:
+    def __init__(self, path, fps=25, sample_rate=16000, crf=20):
+        self.path = str(path)
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.crf = crf
+        self.proc = None
+        self.frames = 0
+        self.encode_time = 0.0 # spent blocked on the encoder, observed per clip on close
+        # the output exists from now on (ffmpeg -y truncates it in place), readers may open it before the first frame
+        open(self.path, "wb").close()
+
+        # audio goes through a fifo, fed from its own thread: ffmpeg reads video and audio
+        # interleaved, a blocking write on either pipe from one thread could deadlock.
+        self.fifo_dir = tempfile.mkdtemp(prefix="stream_")
+        self.fifo = os.path.join(self.fifo_dir, "audio.pcm")
+        os.mkfifo(self.fifo)
+        self.audio = Queue()
+        self.audio_thread = threading.Thread(target=self._feed_audio, daemon=True)
+
+    def _start(self, H, W):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{W}x{H}", "-r", str(self.fps), "-i", "pipe:0",
+            "-f", "s16le", "-ar", str(self.sample_rate), "-ac", "1", "-i", self.fifo,
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency", "-crf", str(self.crf),
+            "-pix_fmt", "yuv420p", "-g", str(self.fps),
+            "-c:a", "aac",
+            # a moof/mdat pair per keyframe (every second), playable before the end
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", self.path,
+        ]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.audio_thread.start()
+
+    def _feed_audio(self):
+        with open(self.fifo, "wb") as f:
+            while True:
+                data = self.audio.get()
+                if data is None:
+                    break
+                try:
+                    f.write(data)
+                except BrokenPipeError:
+                    break
+
+    def write_audio(self, pcm):
+        # float [-1, 1] mono at sample_rate
+        self.audio.put((np.clip(pcm, -1, 1) * 32767).astype(np.int16).tobytes())
+
+    def write_frame(self, frame):
+        # frame: uint8 [H, W, 3]
+        t = time.perf_counter()
+        if self.proc is None:
+            self._start(*frame.shape[:2])
+        self.proc.stdin.write(np.ascontiguousarray(frame).tobytes())
+        self.frames += 1
+        self.encode_time += time.perf_counter() - t
+
+    def close(self):
+        self.audio.put(None)
+        try:
+            if self.proc is None:
+                raise RuntimeError("no frames written")
+            t = time.perf_counter()
+            self.proc.stdin.close()
+            err = self.proc.stderr.read().decode(errors="replace")
+            if self.proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed: {err[-2000:]}")
+            self.audio_thread.join()
+            ENCODE_SECONDS.observe(self.encode_time + time.perf_counter() - t, streaming="1")
+        finally:
+            self._remove_fifo()
+        return self.path
+
+    def abort(self):
+        # the render failed: stop the encoder, leave the partial file as it is. never raises, so it
+        # does not mask the exception being handled.
+        self.audio.put(None)
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            for pipe in (self.proc.stdin, self.proc.stderr):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+            # the audio thread may still block opening the fifo for ffmpeg: open the other end once,
+            # its writes then fail with BrokenPipeError and it exits
+            try:
+                os.close(os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self.audio_thread.join(timeout=5)
+        self._remove_fifo()
+
+    def _remove_fifo(self):
+        try:
+            os.unlink(self.fifo)
+            os.rmdir(self.fifo_dir)
+        except OSError:
+            pass
+
+
+def tail_file(f, done, chunk=64 << 10, poll=0.05):
+    # yield the bytes of an open file that is still being written, until done() and no more data.
+    # takes the open file so the writer may rename / move it meanwhile.
+    with f:
+        while True:
+            data = f.read(chunk)
+            if data:
+                yield data
+            elif done():
+                data = f.read()
+                if data:
+                    yield data
+                return
+            else:
+                time.sleep(poll)